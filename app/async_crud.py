@@ -0,0 +1,135 @@
+"""
+Database helpers for use with database.AsyncSessionLocal.
+"""
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from . import database, models
+import uuid
+import json
+
+async def upsert_user(db: AsyncSession, line_user_id: str):
+    """
+    Returns the id of the user with line_user_id, creating the user if needed. A single
+    statement, so two first messages racing each other cannot trip the unique index.
+    """
+    stmt = database.insert_for(db)(models.User).values(line_user_id=line_user_id)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.User.line_user_id],
+        set_={"line_user_id": stmt.excluded.line_user_id},
+    ).returning(models.User.id)
+    user_id = await db.scalar(stmt)
+    await db.commit()
+    return user_id
+
+async def get_watches_by_user(db: AsyncSession, user_id: uuid.UUID):
+    return (await db.scalars(select(models.Watch).filter(models.Watch.user_id == user_id))).all()
+
+async def create_watches(db: AsyncSession, user_id: uuid.UUID, prefectures: list, product_url: str, product_code: str):
+    """
+    Adds one watch per prefecture in a single commit (one multi-row INSERT).
+    """
+    db_watches = [
+        models.Watch(user_id=user_id, prefecture=prefecture, product_url=product_url, product_code=product_code)
+        for prefecture in prefectures
+    ]
+    db.add_all(db_watches)
+    await db.commit()
+    return db_watches
+
+async def delete_watch(db: AsyncSession, watch_id: uuid.UUID, user_id: uuid.UUID):
+    # Bulk deletes scoped to the owner instead of loading the watch and cascading through the ORM
+    owned = select(models.Watch.id).filter(models.Watch.id == watch_id, models.Watch.user_id == user_id)
+    await db.execute(delete(models.Notification).filter(models.Notification.watch_id.in_(owned)).execution_options(synchronize_session=False))
+    result = await db.execute(delete(models.Watch).filter(models.Watch.id == watch_id, models.Watch.user_id == user_id).execution_options(synchronize_session=False))
+    await db.commit()
+    return result.rowcount > 0
+
+async def get_watches_for_keys(db: AsyncSession, keys: list):
+    """
+    Loads the watches (with users) for the given (product_code, prefecture) keys.
+    Callers pass one claimed batch at a time, so the result is bounded.
+    """
+    stmt = (
+        select(models.Watch)
+        .options(joinedload(models.Watch.user))
+        .filter(tuple_(models.Watch.product_code, models.Watch.prefecture).in_(keys))
+    )
+    return (await db.scalars(stmt)).all()
+
+async def create_notifications(db: AsyncSession, rows: list, batch_size: int = 500):
+    """
+    Bulk inserts (watch_id, shop_ids, removed_shop_ids) rows, committing once per batch.
+    """
+    for i in range(0, len(rows), batch_size):
+        await db.execute(
+            insert(models.Notification),
+            [
+                {"watch_id": watch_id, "shop_ids": json.dumps(shop_ids), "removed_shop_ids": json.dumps(removed_shop_ids)}
+                for watch_id, shop_ids, removed_shop_ids in rows[i:i + batch_size]
+            ]
+        )
+        await db.commit()
+
+async def create_stock_events(db: AsyncSession, rows: list, batch_size: int = 500):
+    """
+    Appends stock_events rows (dicts), committing once per batch.
+    """
+    for i in range(0, len(rows), batch_size):
+        await db.execute(insert(models.StockEvent), rows[i:i + batch_size])
+        await db.commit()
+
+async def get_or_create_shop_ids(db: AsyncSession, shops: dict, chunk_size: int = 500):
+    """
+    Maps shop keys to shops.id, inserting shops that have not been seen before.
+    `shops` maps each "name|address" key to its {"name", "address"} dict.
+    """
+    keys = list(shops)
+    shop_ids = {}
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i:i + chunk_size]
+        rows = await db.execute(select(models.Shop.shop_key, models.Shop.id).filter(models.Shop.shop_key.in_(chunk)))
+        shop_ids.update(rows.all())
+
+    missing = [key for key in keys if key not in shop_ids]
+    # Another worker may intern the same shop at the same time; the re-select picks up whichever row won
+    insert_shops = database.insert_for(db)(models.Shop).on_conflict_do_nothing(index_elements=["shop_key"])
+    for i in range(0, len(missing), chunk_size):
+        await db.execute(
+            insert_shops,
+            [{"shop_key": key, "name": shops[key]["name"], "address": shops[key]["address"]} for key in missing[i:i + chunk_size]]
+        )
+        rows = await db.execute(select(models.Shop.shop_key, models.Shop.id).filter(models.Shop.shop_key.in_(missing[i:i + chunk_size])))
+        shop_ids.update(rows.all())
+    return shop_ids
+
+async def get_stock_snapshot(db: AsyncSession, product_code: str, prefecture: str):
+    return await db.scalar(select(models.StockSnapshot).filter(
+        models.StockSnapshot.product_code == product_code,
+        models.StockSnapshot.prefecture == prefecture
+    ).limit(1))
+
+async def get_stock_snapshots(db: AsyncSession, product_codes):
+    """
+    Loads the snapshots for all given product codes in one query, keyed by (product_code, prefecture).
+    """
+    snapshots = (await db.scalars(select(models.StockSnapshot).filter(models.StockSnapshot.product_code.in_(list(product_codes))))).all()
+    return {(s.product_code, s.prefecture): s for s in snapshots}
+
+def stage_stock_snapshot(db: AsyncSession, product_code: str, prefecture: str, fingerprint: str, shop_keys: list, snapshot=None):
+    """
+    Updates `snapshot`, or adds a new one, without any I/O. An AsyncSession cannot be
+    used by several tasks at once, so concurrent crawl tasks stage and the caller commits.
+    """
+    if snapshot is None:
+        snapshot = models.StockSnapshot(product_code=product_code, prefecture=prefecture)
+        db.add(snapshot)
+    snapshot.fingerprint = fingerprint
+    snapshot.shop_keys = json.dumps(shop_keys, ensure_ascii=False)
+    return snapshot
+
+async def create_crawl_run(db: AsyncSession, **fields):
+    crawl_run = models.CrawlRun(**fields)
+    db.add(crawl_run)
+    await db.commit()
+    return crawl_run
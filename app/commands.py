@@ -0,0 +1,48 @@
+"""
+Parser for the LINE text commands. The keyword table and the product code
+pattern are built once at import.
+"""
+import re
+from collections import namedtuple
+
+Command = namedtuple("Command", ["name", "keyword", "arity", "usage"])
+ParsedCommand = namedtuple("ParsedCommand", ["name", "args"])
+
+# Arguments are whitespace separated (full-width spaces included)
+COMMANDS = (
+    Command("register", "登録", 2, "登録 {都道府県または地方} {商品URL}"),
+    Command("list", "一覧", 0, None),
+    Command("delete", "削除", 1, "削除 {監視ID}"),
+    Command("check", "確認", 0, None),
+)
+_BY_KEYWORD = {command.keyword: command for command in COMMANDS}
+_KEYWORD_LENGTHS = sorted({len(keyword) for keyword in _BY_KEYWORD}, reverse=True)
+# Commands without arguments always parse to the same value
+_NO_ARGS = {command.name: ParsedCommand(command.name, ()) for command in COMMANDS if not command.arity}
+
+# https://gashapon.jp/shop/gplus_list.php?product_code=XXXXXX
+# https://gashapon.jp/products/detail.php?jan_code=XXXXXX
+PRODUCT_CODE_RE = re.compile(r"(?:product_code|jan_code)=([a-zA-Z0-9]+)")
+
+
+def parse(text: str):
+    """
+    Returns ParsedCommand(name, args) for a known command, with args None when the
+    arguments do not match its format, or None for anything else (help).
+    """
+    text = text.strip()
+    for length in _KEYWORD_LENGTHS:
+        command = _BY_KEYWORD.get(text[:length])
+        if command is not None:
+            break
+    else:
+        return None
+
+    args = text[length:].split()
+    if not command.arity:
+        return None if args else _NO_ARGS[command.name]
+    return ParsedCommand(command.name, tuple(args) if len(args) == command.arity else None)
+
+
+def usage(name: str) -> str:
+    return next(command.usage for command in COMMANDS if command.name == name)
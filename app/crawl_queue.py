@@ -0,0 +1,189 @@
+import os
+import uuid
+import socket
+import asyncio
+import logging
+import weakref
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import Session
+from . import database, models
+
+logger = logging.getLogger(__name__)
+
+CRAWL_LEASE_SECONDS = int(os.getenv("CRAWL_LEASE_SECONDS", "300"))
+CRAWL_CLAIM_BATCH = int(os.getenv("CRAWL_CLAIM_BATCH", "50"))
+# SQLite has no row locks; claims are serialized with this file lock instead
+SQLITE_LOCK_PATH = os.getenv("CRAWL_LOCK_PATH", "./crawl_queue.lock")
+# How often a waiting claim retries the file lock held by another process
+SQLITE_LOCK_POLL = 0.05
+
+# One asyncio.Lock per event loop serializes claims within the process
+_loop_locks = weakref.WeakKeyDictionary()
+
+ACTIVE_STATUSES = ("pending", "leased")
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def enqueue_run(db: Session) -> tuple:
+    """
+    Enqueues one pending item per unique (product_code, prefecture) being watched.
+    Keys that already have a pending or leased item are skipped, so overlapping
+    triggers are harmless. Returns (run_id, number of items enqueued).
+    """
+    keys = db.query(models.Watch.product_code, models.Watch.prefecture).distinct().all()
+    return enqueue_keys(db, keys)
+
+
+def enqueue_keys(db: Session, keys: list) -> tuple:
+    """
+    Enqueues the given (product_code, prefecture) keys, skipping already active ones.
+    """
+    run_id = uuid.uuid4().hex
+    if not keys:
+        return run_id, 0
+
+    insert = database.insert_for(db)
+    stmt = insert(models.CrawlItem).values([
+        {"run_id": run_id, "product_code": product_code, "prefecture": prefecture, "status": "pending", "attempts": 0}
+        for product_code, prefecture in keys
+    ]).on_conflict_do_nothing(
+        index_elements=["product_code", "prefecture"],
+        index_where=models.CrawlItem.status.in_(ACTIVE_STATUSES),
+    )
+    result = db.execute(stmt)
+    db.commit()
+    enqueued = result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(keys)
+    logger.info(f"Enqueued crawl run {run_id}: {enqueued} of {len(keys)} keys ({len(keys) - enqueued} already queued)")
+    return run_id, enqueued
+
+
+@asynccontextmanager
+async def claim_lock(dialect_name: str):
+    """
+    Serializes claim_batch calls on SQLite without blocking the event loop: an
+    asyncio.Lock between drains of this process, then a non-blocking flock polled
+    between other processes. Postgres relies on FOR UPDATE SKIP LOCKED instead.
+    """
+    if dialect_name != "sqlite":
+        yield
+        return
+
+    import fcntl
+    loop = asyncio.get_running_loop()
+    lock = _loop_locks.setdefault(loop, asyncio.Lock())
+    async with lock:
+        with open(SQLITE_LOCK_PATH, "a") as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(SQLITE_LOCK_POLL)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def claim_batch(db: Session, owner: str, batch_size: int = CRAWL_CLAIM_BATCH, lease_seconds: int = CRAWL_LEASE_SECONDS) -> list:
+    """
+    Leases up to batch_size pending (or lease-expired) items to owner and returns them.
+    Callers hold claim_lock around it.
+    """
+    now = datetime.now(timezone.utc)
+    items = (
+        db.query(models.CrawlItem)
+        .filter(or_(
+            models.CrawlItem.status == "pending",
+            and_(models.CrawlItem.status == "leased", models.CrawlItem.lease_expires_at < now),
+        ))
+        .order_by(models.CrawlItem.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for item in items:
+        if item.status == "leased":
+            logger.info(f"Reclaiming expired lease on {item.prefecture} - {item.product_code} from {item.lease_owner}")
+        item.status = "leased"
+        item.lease_owner = owner
+        item.lease_expires_at = now + timedelta(seconds=lease_seconds)
+        item.attempts += 1
+    db.commit()
+    return items
+
+
+def complete_items(db: Session, owner: str, item_ids: list):
+    """
+    Marks items done, unless their lease was lost to another worker in the meantime.
+    """
+    if not item_ids:
+        return
+    db.query(models.CrawlItem).filter(
+        models.CrawlItem.id.in_(item_ids),
+        models.CrawlItem.lease_owner == owner,
+        models.CrawlItem.status == "leased",
+    ).update({"status": "done", "lease_expires_at": None}, synchronize_session=False)
+    db.commit()
+
+
+def release_items(db: Session, owner: str, item_ids: list):
+    """
+    Returns unfinished items to the queue so another worker can pick them up.
+    """
+    if not item_ids:
+        return
+    db.query(models.CrawlItem).filter(
+        models.CrawlItem.id.in_(item_ids),
+        models.CrawlItem.lease_owner == owner,
+        models.CrawlItem.status == "leased",
+    ).update({"status": "pending", "lease_owner": None, "lease_expires_at": None}, synchronize_session=False)
+    db.commit()
+
+
+def add_requests(db: Session, request_counts: dict):
+    """
+    Adds the upstream requests spent on each item ({item id: requests}) to its count.
+    """
+    by_count = defaultdict(list)
+    for item_id, requests in request_counts.items():
+        if requests:
+            by_count[requests].append(item_id)
+    if not by_count:
+        return
+    for requests, item_ids in by_count.items():
+        db.query(models.CrawlItem).filter(models.CrawlItem.id.in_(item_ids)).update(
+            {"requests": models.CrawlItem.requests + requests}, synchronize_session=False
+        )
+    db.commit()
+
+
+def count_requests_since(db: Session, since) -> int:
+    """
+    Upstream requests spent since `since`: the recorded count of items worked on
+    since then, plus one for each active item that has not been fetched yet.
+    """
+    spent = db.query(func.coalesce(func.sum(models.CrawlItem.requests), 0)).filter(
+        models.CrawlItem.updated_at >= since,
+    ).scalar()
+    unfetched = db.query(models.CrawlItem).filter(
+        models.CrawlItem.status.in_(("pending", "leased")),
+        models.CrawlItem.requests == 0,
+    ).count()
+    return spent + unfetched
+
+
+def prune_done_items(db: Session, older_than_hours: int = 24) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=older_than_hours)
+    deleted = db.query(models.CrawlItem).filter(
+        models.CrawlItem.status == "done",
+        models.CrawlItem.updated_at < cutoff,
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -1,47 +1,315 @@
 import logging
 import asyncio
-from sqlalchemy.orm import Session
-from linebot import LineBotApi
+from collections import defaultdict
+from sqlalchemy.ext.asyncio import AsyncSession
 from linebot.models import TextSendMessage
-from . import crud, scraper, models
+from . import async_crud, models, scraper, snapshots, stock_history, line_client, line_dispatcher, database, crawl_queue, result_cache, metrics, http_client
 import os
-import json
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 
-LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN) if LINE_CHANNEL_ACCESS_TOKEN else None
+dispatcher = line_dispatcher.PushDispatcher(line_client.get_line_bot_api)
 
-async def run_crawl_task(db: Session):
-    logger.info("Starting crawl task")
-    watches = crud.get_all_watches(db)
-    
-    if not watches:
-        logger.info("No watches found.")
-        return
+# Maximum number of fetches in flight at once
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "8"))
+# Total wall-clock budget for a crawl in seconds (0 = unlimited)
+CRAWL_TIME_BUDGET = float(os.getenv("CRAWL_TIME_BUDGET", "0"))
+# Also tell users about shops that went out of stock
+NOTIFY_REMOVED = os.getenv("NOTIFY_REMOVED", "false").lower() == "true"
+# LINE limits: 5 message objects per push request, 5000 characters per text message
+MESSAGES_PER_PUSH = 5
+MESSAGE_MAX_CHARS = 5000
+SECTION_SEPARATOR = "\n\n━━━━━━━━━━\n"
+# Notification rows inserted per commit
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "500"))
 
+def plan_crawl(watches):
+    """
+    Groups watches by (product_code, prefecture) so each unique key is fetched once.
+    Returns a dict mapping the key to the list of watches that want it.
+    """
+    plan = defaultdict(list)
     for watch in watches:
+        plan[(watch.product_code, watch.prefecture)].append(watch)
+    return plan
+
+async def run_crawl_task():
+    """
+    Enqueues this run's work items and drains the queue in-process. Extra
+    `python -m app.crawl_worker` processes can drain the same queue in parallel.
+    """
+    logger.info("Starting crawl task")
+    async with database.AsyncSessionLocal() as db:
+        await db.run_sync(crawl_queue.enqueue_run)
+    await drain_queue()
+
+async def drain_queue(owner: str = None):
+    """
+    Claims batches of crawl items until the queue is empty or the time budget runs out.
+    The crawl opens its own session so it never holds on to a request's connection.
+    """
+    async with database.AsyncSessionLocal() as db:
+        await _drain_queue(db, owner)
+
+async def _drain_queue(db: AsyncSession, owner: str = None):
+    owner = owner or crawl_queue.worker_id()
+    deadline = time.monotonic() + CRAWL_TIME_BUDGET if CRAWL_TIME_BUDGET else None
+    dispatcher.reset_stats()
+    started_at = time.monotonic()
+    started_at_utc = datetime.now(timezone.utc)
+    total_items = 0
+    stats = {"shops_found": 0, "changed_keys": 0, "notifications_sent": 0, "fetch_failures": 0}
+
+    # Results are notified once at the end, so a user whose watches span several batches gets one push
+    results = []
+    with database.track_queries() as query_stats, http_client.deadline(CRAWL_TIME_BUDGET):
         try:
-            logger.info(f"Checking watch {watch.id}: {watch.prefecture} - {watch.product_code}")
-            shops = await scraper.fetch_shops(watch.product_code, watch.prefecture)
-            
+            while True:
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    logger.warning(f"Crawl time budget of {CRAWL_TIME_BUDGET}s exhausted, leaving the rest of the queue")
+                    break
+
+                async with crawl_queue.claim_lock(db.bind.dialect.name):
+                    items = await db.run_sync(crawl_queue.claim_batch, owner)
+                if not items:
+                    break
+
+                item_ids = {(item.product_code, item.prefecture): item.id for item in items}
+                plan = plan_crawl(await async_crud.get_watches_for_keys(db, list(item_ids)))
+                request_counts = {}
+                completed, batch_results = await process_plan(db, plan, remaining, stats, request_counts)
+                results.extend(batch_results)
+                # The scheduler's hourly budget is charged with what the fetches really sent
+                await db.run_sync(crawl_queue.add_requests, {item_ids[key]: requests for key, requests in request_counts.items()})
+                # Keys whose watches were all deleted since enqueueing have nothing to crawl
+                done_ids = [item_id for key, item_id in item_ids.items() if key in completed or key not in plan]
+                await db.run_sync(crawl_queue.complete_items, owner, done_ids)
+                await db.run_sync(crawl_queue.release_items, owner, [item_id for item_id in item_ids.values() if item_id not in done_ids])
+                total_items += len(done_ids)
+
+                if http_client.is_circuit_open(scraper.GPLUS_HOST):
+                    logger.warning(f"Circuit open for {scraper.GPLUS_HOST}, deferring the rest of the queue")
+                    break
+        finally:
+            # Snapshots of these keys are already committed, so their changes must still go out
+            await notify_and_record(db, results, stats)
+
+    elapsed = time.monotonic() - started_at
+    throughput = total_items / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Crawl worker {owner} completed {total_items} requests in {elapsed:.1f}s ({throughput:.2f} req/s)")
+    push_stats = dispatcher.stats()
+    logger.info(
+        f"Push stats: {push_stats['messages_sent']} sent in {push_stats['api_calls']} calls, "
+        f"{push_stats['failures']} failed, {push_stats['messages_per_second']:.2f} msg/s, "
+        f"queue depth {push_stats['queue_depth']}"
+    )
+    logger.info(f"Crawl DB stats: {query_stats.count} queries, {query_stats.total_seconds * 1000:.1f}ms total")
+    logger.info(f"Shop cache stats: {result_cache.shop_cache.stats()}")
+
+    metrics.CRAWL_DURATION.observe(elapsed)
+    if total_items:
+        await async_crud.create_crawl_run(
+            db,
+            worker=owner,
+            started_at=started_at_utc,
+            finished_at=datetime.now(timezone.utc),
+            requests=total_items,
+            push_failures=push_stats["failures"],
+            db_queries=query_stats.count,
+            db_seconds=query_stats.total_seconds,
+            **stats,
+        )
+
+async def process_plan(db: AsyncSession, plan: dict, time_budget: float = None, stats: dict = None, request_counts: dict = None) -> tuple:
+    """
+    Crawls every key in the plan concurrently and stores the new snapshots and stock
+    history. Returns (keys that finished, crawl_key results to notify);
+    deferred and timed-out keys are left out. Upstream requests per key, finished
+    or not, are stored in `request_counts`.
+    """
+    if not plan:
+        return set(), []
+
+    watch_count = sum(len(key_watches) for key_watches in plan.values())
+    logger.info(f"Crawl plan: {watch_count} watches -> {len(plan)} unique requests ({watch_count - len(plan)} saved)")
+    snapshot_map = await async_crud.get_stock_snapshots(db, {product_code for product_code, _ in plan})
+
+    semaphore = asyncio.Semaphore(CRAWL_CONCURRENCY)
+    changes = []
+    tasks = {
+        asyncio.create_task(crawl_key(product_code, prefecture, key_watches, db, semaphore, snapshot_map.get((product_code, prefecture)), stats, changes, request_counts)): (product_code, prefecture)
+        for (product_code, prefecture), key_watches in plan.items()
+    }
+    done, pending = await asyncio.wait(tasks, timeout=time_budget)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        logger.warning(f"Crawl time budget exceeded, {len(pending)} requests deferred")
+
+    finished = [task for task in done if not task.cancelled() and not task.exception()]
+    results = [entry for task in finished for entry in task.result()]
+
+    # Snapshot updates staged by the crawl tasks are committed with the stock history
+    shop_ids = await async_crud.get_or_create_shop_ids(db, collect_shops((added, removed) for _, _, added, removed, _ in changes))
+    await async_crud.create_stock_events(db, stock_history.event_rows(changes, shop_ids), NOTIFICATION_BATCH_SIZE)
+
+    completed = {tasks[task] for task in finished}
+    gaps = await stock_history.restock_gaps(db, [key for key in completed if key in snapshot_map])
+    for key, mean_gap in gaps.items():
+        snapshots.apply_restock_hint(snapshot_map[key], mean_gap)
+    await db.commit()
+
+    return completed, results
+
+async def notify_and_record(db: AsyncSession, results: list, stats: dict = None):
+    """
+    Pushes a drain's results and stores a notification row for every section sent.
+    """
+    if not results:
+        return
+    sent = await notify_users(results)
+    if stats is not None:
+        stats["notifications_sent"] += len(sent)
+    shop_ids = await async_crud.get_or_create_shop_ids(db, collect_shops((added, removed) for _, added, removed in sent))
+    await async_crud.create_notifications(db, build_notification_rows(sent, shop_ids), NOTIFICATION_BATCH_SIZE)
+
+def collect_shops(entries) -> dict:
+    """
+    Maps the shop keys of all (added shops, removed keys) pairs to {"name", "address"}.
+    """
+    shops = {}
+    for added, removed in entries:
+        for shop in added:
+            shops[snapshots.shop_key(shop)] = shop
+        for key in removed:
+            name, _, address = key.partition("|")
+            shops.setdefault(key, {"name": name, "address": address})
+    return shops
+
+def build_notification_rows(sent: list, shop_ids: dict) -> list:
+    """
+    Converts sent (watch_id, added, removed) entries into notification rows that
+    reference shops by id instead of repeating the full shop list.
+    """
+    return [
+        (
+            watch_id,
+            [shop_ids[snapshots.shop_key(shop)] for shop in added],
+            [shop_ids[key] for key in removed],
+        )
+        for watch_id, added, removed in sent
+    ]
+
+async def crawl_key(product_code: str, prefecture: str, key_watches: list, db: AsyncSession, semaphore: asyncio.Semaphore, snapshot=None, stats: dict = None, changes: list = None, request_counts: dict = None):
+    """
+    Fetches one (product_code, prefecture) key and returns the (watch, added, removed,
+    full list) results to notify, or an empty list when nothing changed. `full list` is
+    True for watches that get every shop in stock rather than a diff. Every change is also
+    appended to `changes` for the stock history, and the upstream requests the fetch
+    took are stored in `request_counts` under the key.
+    """
+    async with semaphore:
+        with http_client.count_requests() as request_count:
+            try:
+                logger.info(f"Checking {prefecture} - {product_code} for {len(key_watches)} watches")
+                # A fresh on-demand check (確認) can answer for the crawl, and vice versa
+                shops = await result_cache.fetch_shops_cached(product_code, prefecture)
+            except scraper.FetchDeferred:
+                # Not attempted; the work item goes back to the queue
+                raise
+            except scraper.FetchError as e:
+                # A failed fetch says nothing about stock: keep the snapshot and retry later
+                logger.error(f"Fetch failed for {prefecture} - {product_code}: {e}")
+                if snapshot is not None:
+                    snapshots.record_poll_failure(snapshot, datetime.now(timezone.utc))
+                if stats is not None:
+                    stats["fetch_failures"] += 1
+                return []
+            except Exception as e:
+                logger.error(f"Error fetching {prefecture} - {product_code}: {e}")
+                return []
+            finally:
+                # Failed, deferred and cancelled fetches still spent their requests
+                if request_counts is not None:
+                    request_counts[(product_code, prefecture)] = request_count.requests
+
+    if stats is not None:
+        stats["shops_found"] += len(shops)
+
+    # Compare against the last seen shop set and only notify on changes. Watches added
+    # since the previous crawl have never seen that set, so they get the full list instead.
+    new_watches = set(key_watches) if snapshot is None else set(watches_added_since(key_watches, snapshot))
+    new_fingerprint, shop_keys = snapshots.build_snapshot(shops)
+    now = datetime.now(timezone.utc)
+    if snapshot is not None and snapshot.fingerprint == new_fingerprint:
+        logger.info(f"No stock change for {prefecture} - {product_code}")
+        snapshots.record_poll(snapshot, False, now)
+        return [(watch, shops, [], True) for watch in key_watches if watch in new_watches and shops]
+
+    added, removed = snapshots.diff_shops(snapshots.load_keys(snapshot), shops)
+    # The snapshot map is preloaded, so a missing snapshot means this key is new
+    snapshot = async_crud.stage_stock_snapshot(db, product_code, prefecture, new_fingerprint, shop_keys, snapshot=snapshot)
+    snapshots.record_poll(snapshot, True, now)
+    if stats is not None:
+        stats["changed_keys"] += 1
+    if changes is not None and (added or removed):
+        changes.append((product_code, prefecture, added, removed, now))
+    if not NOTIFY_REMOVED:
+        removed = []
+
+    results = []
+    for watch in key_watches:
+        if watch in new_watches:
             if shops:
-                # Send notification
-                user = db.query(models.User).filter(models.User.id == watch.user_id).first()
-                if user and user.line_user_id:
-                    await send_notification(user.line_user_id, watch, shops, db)
-            else:
-                logger.info(f"No shops found for watch {watch.id}")
-                
+                results.append((watch, shops, [], True))
+        elif added or removed:
+            results.append((watch, added, removed, False))
+    if not results:
+        logger.info(f"No new shops for {prefecture} - {product_code}")
+    return results
+
+def watches_added_since(key_watches: list, snapshot) -> list:
+    """
+    Returns the watches created after the snapshot last reflected a crawl.
+    """
+    seen_at = database.as_utc(snapshot.last_crawled_at or snapshot.updated_at)
+    if seen_at is None:
+        return list(key_watches)
+    return [watch for watch in key_watches if watch.created_at is not None and database.as_utc(watch.created_at) > seen_at]
+
+async def notify_users(results: list):
+    """
+    Coalesces all of a crawl's results into as few pushes per user as possible.
+    Returns the (watch_id, added, removed) entries for the pushes that were sent.
+    """
+    # Keyed by id: watches claimed in different batches carry separately loaded users
+    by_user = {}
+    for entry in results:
+        watch = entry[0]
+        by_user.setdefault(watch.user_id, (watch.user, []))[1].append(entry)
+
+    async def notify_user(user, entries):
+        try:
+            if user and user.line_user_id:
+                return await send_notification(user.line_user_id, entries)
         except Exception as e:
-            logger.error(f"Error processing watch {watch.id}: {e}")
+            logger.error(f"Error notifying user {user.id}: {e}")
+        return []
 
-    logger.info("Crawl task completed")
+    sent = await asyncio.gather(*(notify_user(user, entries) for user, entries in by_user.values()))
+    return [row for rows in sent for row in rows]
 
-async def send_notification(line_user_id: str, watch: models.Watch, shops: list, db: Session):
-    now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
-    title = f"[{now_str} 時点]\n{watch.prefecture}で在庫ありの店舗一覧"
+def render_watch_section(watch: models.Watch, shops: list, removed: list, full_list: bool = False) -> str:
+    if full_list:
+        title = f"{watch.prefecture}で現在在庫のある店舗"
+    elif shops:
+        title = f"{watch.prefecture}で新たに在庫ありになった店舗"
+    else:
+        title = f"{watch.prefecture}で在庫なしになった店舗: {len(removed)} 件"
     
     # Limit number of shops to avoid hitting message size limits
     display_shops = shops[:10]
@@ -53,19 +321,58 @@ async def send_notification(line_user_id: str, watch: models.Watch, shops: list,
     if len(shops) > 10:
         shop_lines.append(f"\n他 {len(shops) - 10} 件...")
 
-    message_text = f"{title}\n\n" + "\n".join(shop_lines)
-    message_text += f"\n\n検索結果: {watch.product_url}"
-
-    try:
-        if line_bot_api:
-            line_bot_api.push_message(line_user_id, TextSendMessage(text=message_text))
-            
-            # Log notification
-            payload = json.dumps({"shops": shops}, ensure_ascii=False)
-            crud.create_notification(db, watch.id, payload)
-            logger.info(f"Notification sent to {line_user_id}")
-        else:
-            logger.warning("LINE_CHANNEL_ACCESS_TOKEN not set, skipping push message")
-            
-    except Exception as e:
-        logger.error(f"Failed to send push message to {line_user_id}: {e}")
+    if removed:
+        if shops:
+            shop_lines.append(f"\n在庫なしになった店舗: {len(removed)} 件")
+        for key in removed[:5]:
+            shop_lines.append(f"・{key.split('|', 1)[0]}")
+
+    section = f"{title}\n\n" + "\n".join(shop_lines)
+    section += f"\n\n検索結果: {watch.product_url}"
+    return section
+
+def pack_messages(header: str, sections: list) -> list:
+    """
+    Packs rendered sections into text bubbles of at most MESSAGE_MAX_CHARS and groups
+    the bubbles into pushes of at most MESSAGES_PER_PUSH. Returns a list of
+    (bubble texts, indexes of the sections they contain) per push.
+    """
+    bubbles = []
+    current, current_indexes = header, []
+    for index, section in enumerate(sections):
+        section = section[:MESSAGE_MAX_CHARS - len(header) - len(SECTION_SEPARATOR)]
+        if current_indexes and len(current) + len(SECTION_SEPARATOR) + len(section) > MESSAGE_MAX_CHARS:
+            bubbles.append((current, current_indexes))
+            current, current_indexes = header, []
+        current += SECTION_SEPARATOR + section
+        current_indexes.append(index)
+    if current_indexes:
+        bubbles.append((current, current_indexes))
+
+    pushes = []
+    for i in range(0, len(bubbles), MESSAGES_PER_PUSH):
+        chunk = bubbles[i:i + MESSAGES_PER_PUSH]
+        pushes.append(([text for text, _ in chunk], [index for _, indexes in chunk for index in indexes]))
+    return pushes
+
+async def send_notification(line_user_id: str, entries: list):
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
+    header = f"[{now_str} 時点]"
+    sections = [render_watch_section(*entry) for entry in entries]
+
+    if not line_client.get_line_bot_api():
+        logger.warning("LINE_CHANNEL_ACCESS_TOKEN not set, skipping push message")
+        return []
+
+    rows = []
+    for texts, indexes in pack_messages(header, sections):
+        try:
+            await dispatcher.push(line_user_id, [TextSendMessage(text=text) for text in texts])
+        except Exception as e:
+            logger.error(f"Failed to send push message to {line_user_id}: {e}")
+            continue
+
+        # Notification rows are bulk inserted by the caller once the crawl is done
+        rows.extend((entries[index][0].id, entries[index][1], entries[index][2]) for index in indexes)
+        logger.info(f"Notification sent to {line_user_id} ({len(texts)} bubbles, {len(indexes)} watches)")
+    return rows
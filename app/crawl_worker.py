@@ -0,0 +1,43 @@
+"""
+Standalone crawl worker. Run any number of these next to the web service to add
+crawl capacity; they drain the same database-leased queue as /cron/crawl.
+
+Usage: python -m app.crawl_worker [--enqueue] [--poll SECONDS]
+"""
+import os
+import argparse
+import asyncio
+import logging
+from . import database, crawl_task, crawl_queue, http_client, schema
+
+logger = logging.getLogger(__name__)
+
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+
+async def main(enqueue: bool, poll: float):
+    owner = crawl_queue.worker_id()
+    try:
+        if enqueue:
+            async with database.AsyncSessionLocal() as db:
+                await db.run_sync(crawl_queue.enqueue_run)
+        while True:
+            await crawl_task.drain_queue(owner)
+            if not poll:
+                break
+            await asyncio.sleep(poll)
+    finally:
+        await http_client.close_client()
+        await database.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # Workers may start before (or without) the web service's pre-deploy migration
+    if MIGRATE_ON_STARTUP:
+        schema.ensure_migrated()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--enqueue", action="store_true", help="enqueue a new crawl run before draining")
+    parser.add_argument("--poll", type=float, default=0, help="keep polling the queue every N seconds")
+    args = parser.parse_args()
+    asyncio.run(main(args.enqueue, args.poll))
@@ -1,7 +1,14 @@
 import os
-from sqlalchemy import create_engine
+import time
+import contextvars
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from . import metrics
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -11,14 +18,95 @@ if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
 if not DATABASE_URL:
     DATABASE_URL = "sqlite:///./test.db"
 
-engine = create_engine(DATABASE_URL)
+# Explicit pool sizing (ignored by SQLite, which uses its own pool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+def _pool_options(url: str) -> dict:
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+    }
+
+def _async_url(url: str) -> str:
+    """
+    Maps the sync DATABASE_URL onto its async driver: asyncpg for Postgres, aiosqlite for SQLite.
+    """
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+engine = create_engine(DATABASE_URL, **_pool_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Used by the webhook and crawl paths so queries do not block the event loop
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_pool_options(DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
+# Query statistics for the current task (e.g. one crawl), set by track_queries()
+_query_stats = contextvars.ContextVar("query_stats", default=None)
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started_at = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started_at
+    metrics.DB_LATENCY.observe(elapsed)
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.total_seconds += elapsed
+
+for _engine in (engine, async_engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
+@contextmanager
+def track_queries():
+    """
+    Counts queries and their latency for the current context and any tasks it spawns.
+    """
+    stats = QueryStats()
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+def insert_for(db):
+    """
+    The dialect's INSERT construct, which supports ON CONFLICT, for a Session or AsyncSession.
+    """
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+def as_utc(value: datetime) -> datetime:
+    """
+    Reads a DateTime(timezone=True) value as aware UTC; SQLite hands them back naive.
+    """
+    return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,302 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import httpx
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+# Polite default for gashapon.jp: 2 requests/second with a small burst
+HOST_RATE_PER_SEC = float(os.getenv("HOST_RATE_PER_SEC", "2"))
+HOST_BURST = int(os.getenv("HOST_BURST", "4"))
+# Retries for transient upstream failures (timeouts, 429, 5xx)
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_MAX_RETRY_AFTER = float(os.getenv("HTTP_MAX_RETRY_AFTER", "60"))
+# Circuit breaker: open after this many consecutive failures, probe again after the cooldown
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "60"))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_client = None
+_limiters = {}
+_breakers = {}
+# Monotonic deadline for the current crawl, inherited by the tasks it spawns
+_deadline = contextvars.ContextVar("http_deadline", default=None)
+# Requests sent in the current context (e.g. one crawl key), set by count_requests()
+_request_count = contextvars.ContextVar("http_request_count", default=None)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while the host's circuit breaker is open.
+    """
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when there is no time left in the current deadline for a request or retry.
+    """
+
+
+class CircuitBreaker:
+    """
+    Per-host breaker. Closed: requests flow. Open: requests fail fast until the
+    cooldown passes. Half-open: one probe request decides whether to close again.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def before_request(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < BREAKER_COOLDOWN_SECONDS:
+                raise CircuitOpenError(f"Circuit open for {self.host}")
+            self.state = "half-open"
+            logger.info(f"Circuit half-open for {self.host}, probing")
+        if self.state == "half-open":
+            if self.probe_in_flight:
+                raise CircuitOpenError(f"Circuit half-open for {self.host}, probe in flight")
+            self.probe_in_flight = True
+
+    def release_probe(self):
+        # Called once a request is over however it ended, so a cancelled probe lets the next request probe
+        self.probe_in_flight = False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info(f"Circuit closed for {self.host}")
+        self.state = "closed"
+        self.failures = 0
+        self.probe_in_flight = False
+        metrics.CIRCUIT_OPEN.labels(host=self.host).set(0)
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == "half-open" or self.failures >= BREAKER_FAILURE_THRESHOLD:
+            if self.state != "open":
+                logger.warning(f"Circuit opened for {self.host} after {self.failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+        metrics.CIRCUIT_OPEN.labels(host=self.host).set(1 if self.state == "open" else 0)
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    breaker = _breakers.get(host)
+    if breaker is None:
+        breaker = CircuitBreaker(host)
+        _breakers[host] = breaker
+    return breaker
+
+
+def is_circuit_open(host: str) -> bool:
+    breaker = _breakers.get(host)
+    return breaker is not None and breaker.state == "open" and time.monotonic() - breaker.opened_at < BREAKER_COOLDOWN_SECONDS
+
+
+@contextmanager
+def deadline(seconds_from_now: float):
+    """
+    Bounds every request (including retries) made in this context and its tasks.
+    """
+    token = _deadline.set(time.monotonic() + seconds_from_now if seconds_from_now else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class RequestCount:
+    def __init__(self):
+        self.requests = 0
+
+
+@contextmanager
+def count_requests():
+    """
+    Counts the requests sent (every attempt, retries included) in this context and its tasks.
+    """
+    counter = RequestCount()
+    token = _request_count.set(counter)
+    try:
+        yield counter
+    finally:
+        _request_count.reset(token)
+
+
+def _retry_after(response: httpx.Response):
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter. Tokens refill continuously at `rate` per second
+    up to `capacity`; acquire() waits until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+def get_limiter(host: str) -> TokenBucket:
+    limiter = _limiters.get(host)
+    if limiter is None:
+        limiter = TokenBucket(HOST_RATE_PER_SEC, HOST_BURST)
+        _limiters[host] = limiter
+    return limiter
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the process-wide pooled client, creating it on first use.
+    Connections are kept alive across crawls so TLS handshakes are reused.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            ),
+        )
+        logger.info(f"Created pooled HTTP client (http2={HTTP2_AVAILABLE}, max_connections={HTTP_MAX_CONNECTIONS})")
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _send(url: str, stream: bool = False, **kwargs) -> httpx.Response:
+    # For streamed responses the latency covers the headers only
+    started_at = time.perf_counter()
+    client = get_client()
+    try:
+        response = await client.send(client.build_request("GET", url, **kwargs), stream=stream)
+    except httpx.TimeoutException:
+        metrics.FETCH_LATENCY.labels(status="timeout").observe(time.perf_counter() - started_at)
+        raise
+    except httpx.HTTPError:
+        metrics.FETCH_LATENCY.labels(status="error").observe(time.perf_counter() - started_at)
+        raise
+    metrics.FETCH_LATENCY.labels(status=str(response.status_code)).observe(time.perf_counter() - started_at)
+    if not stream:
+        metrics.FETCH_BYTES.inc(len(response.content))
+    return response
+
+
+async def iter_body(response: httpx.Response):
+    """
+    Yields the body of a streamed response as it arrives, counting downloaded bytes.
+    """
+    async for chunk in response.aiter_bytes():
+        metrics.FETCH_BYTES.inc(len(chunk))
+        yield chunk
+
+
+async def get(url: str, stream: bool = False, **kwargs) -> httpx.Response:
+    """
+    GET through the pooled client, waiting on the per-host rate limiter first.
+    Transient failures are retried with jittered backoff (honouring Retry-After)
+    within the current deadline, and feed the host's circuit breaker.
+    With stream=True the body is left unread; read it with iter_body() and close
+    the response with aclose().
+    """
+    host = httpx.URL(url).host
+    breaker = get_breaker(host)
+    limit = _deadline.get()
+
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        remaining = limit - time.monotonic() if limit else None
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"No time left to fetch {url}")
+
+        breaker.before_request()
+        retry_after = None
+        try:
+            await get_limiter(host).acquire()
+            if remaining is not None:
+                kwargs["timeout"] = min(HTTP_TIMEOUT, remaining)
+            counter = _request_count.get()
+            if counter is not None:
+                counter.requests += 1
+            response = await _send(url, stream=stream, **kwargs)
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            error = e
+        else:
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            error = httpx.HTTPStatusError(f"Server returned {response.status_code}", request=response.request, response=response)
+            retry_after = _retry_after(response)
+            if attempt == HTTP_MAX_RETRIES:
+                return response
+            if stream:
+                await response.aclose()
+        finally:
+            breaker.release_probe()
+
+        if attempt == HTTP_MAX_RETRIES:
+            raise error
+
+        delay = HTTP_BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random())
+        if retry_after is not None:
+            delay = min(retry_after, HTTP_MAX_RETRY_AFTER)
+        if limit and time.monotonic() + delay >= limit:
+            raise DeadlineExceeded(f"Retry of {url} would pass the deadline") from error
+        logger.warning(f"Fetch of {url} failed ({error}), retry {attempt + 1} in {delay:.1f}s")
+        await asyncio.sleep(delay)
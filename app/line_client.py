@@ -0,0 +1,27 @@
+"""
+The LINE Messaging API client shared by webhook replies and crawl pushes.
+Created on first use so processes that never talk to LINE do not pay for it.
+"""
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
+
+line_bot_api = None
+
+
+def get_line_bot_api():
+    """
+    Returns the shared LineBotApi, or None when LINE_CHANNEL_ACCESS_TOKEN is not set.
+    """
+    global line_bot_api
+    if line_bot_api is None and LINE_CHANNEL_ACCESS_TOKEN:
+        from linebot import LineBotApi
+        line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
+    return line_bot_api
+
+
+if not LINE_CHANNEL_ACCESS_TOKEN:
+    logger.warning("LINE_CHANNEL_ACCESS_TOKEN is not set.")
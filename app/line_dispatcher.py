@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import requests
+from linebot.exceptions import LineBotApiError
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+MULTICAST_MAX_RECIPIENTS = 500
+PUSH_MAX_RETRIES = int(os.getenv("PUSH_MAX_RETRIES", "3"))
+PUSH_BACKOFF_BASE = float(os.getenv("PUSH_BACKOFF_BASE", "1.0"))
+# How long the worker waits for more pushes before sending a batch
+PUSH_LINGER_SECONDS = float(os.getenv("PUSH_LINGER_SECONDS", "0.05"))
+
+
+def _payload_key(messages) -> str:
+    return json.dumps([m.as_json_dict() for m in messages], sort_keys=True, ensure_ascii=False)
+
+
+def _retry_after(e: LineBotApiError):
+    value = (e.headers or {}).get("Retry-After") or (e.headers or {}).get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, LineBotApiError):
+        return e.status_code == 429 or e.status_code >= 500
+    # Network errors from the SDK's requests session; anything else is a bug, not a transient failure
+    return isinstance(e, requests.exceptions.RequestException)
+
+
+async def call_with_retry(func, *args, **kwargs):
+    """
+    Runs a blocking LINE SDK call on a worker thread, retrying transient failures
+    with jittered exponential backoff. 429 responses wait for Retry-After when given.
+    """
+    operation = getattr(func, "__name__", "call")
+    for attempt in range(PUSH_MAX_RETRIES + 1):
+        started_at = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(func, *args, **kwargs)
+            metrics.LINE_LATENCY.labels(operation=operation).observe(time.perf_counter() - started_at)
+            return result
+        except Exception as e:
+            metrics.LINE_LATENCY.labels(operation=operation).observe(time.perf_counter() - started_at)
+            metrics.LINE_FAILURES.labels(operation=operation).inc()
+            if attempt == PUSH_MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = PUSH_BACKOFF_BASE * (2 ** attempt) * (1 + random.random())
+            if isinstance(e, LineBotApiError) and e.status_code == 429:
+                delay = _retry_after(e) or delay
+            reason = f"status {e.status_code}" if isinstance(e, LineBotApiError) else e
+            logger.warning(f"LINE API call failed ({reason}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+class PushDispatcher:
+    """
+    Queues push messages and sends them from a background worker. Pushes with
+    identical messages are merged into multicast calls of up to 500 recipients.
+    """
+
+    def __init__(self, get_line_bot_api):
+        # Called on each send so the shared client is only created once it is needed
+        self.get_line_bot_api = get_line_bot_api
+        self.queue = None
+        self.worker = None
+        self.messages_sent = 0
+        self.api_calls = 0
+        self.failures = 0
+        self.started_at = time.monotonic()
+
+    def _ensure_worker(self):
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self._run())
+
+    async def push(self, line_user_id: str, messages: list):
+        """
+        Queues a push and waits until it has been delivered. Raises if delivery failed.
+        """
+        if not self.get_line_bot_api():
+            raise RuntimeError("LINE_CHANNEL_ACCESS_TOKEN not set")
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((line_user_id, messages, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(PUSH_LINGER_SECONDS)
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            groups = {}
+            for line_user_id, messages, future in batch:
+                groups.setdefault(_payload_key(messages), []).append((line_user_id, messages, future))
+
+            await asyncio.gather(*(self._send_group(items) for items in groups.values()))
+
+    async def _send_group(self, items):
+        messages = items[0][1]
+        line_bot_api = self.get_line_bot_api()
+        for i in range(0, len(items), MULTICAST_MAX_RECIPIENTS):
+            chunk = items[i:i + MULTICAST_MAX_RECIPIENTS]
+            recipients = [line_user_id for line_user_id, _, _ in chunk]
+            try:
+                if len(recipients) == 1:
+                    await call_with_retry(line_bot_api.push_message, recipients[0], messages)
+                else:
+                    await call_with_retry(line_bot_api.multicast, recipients, messages)
+            except Exception as e:
+                self.failures += len(chunk)
+                for _, _, future in chunk:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.api_calls += 1
+            self.messages_sent += len(chunk)
+            for _, _, future in chunk:
+                if not future.done():
+                    future.set_result(None)
+
+    def reset_stats(self):
+        self.messages_sent = 0
+        self.api_calls = 0
+        self.failures = 0
+        self.started_at = time.monotonic()
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "messages_sent": self.messages_sent,
+            "api_calls": self.api_calls,
+            "failures": self.failures,
+            "messages_per_second": self.messages_sent / elapsed if elapsed > 0 else 0.0,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+        }
@@ -1,171 +1,205 @@
 import os
-import re
+import asyncio
 import logging
-from fastapi import Request, HTTPException, BackgroundTasks
-from linebot import LineBotApi, WebhookHandler
+from fastapi import Request, HTTPException
+from linebot import WebhookParser
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
-from sqlalchemy.orm import Session
-from . import crud, models, scraper
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import async_crud, commands, models, prefectures, line_client, line_dispatcher, metrics, database, webhook_pipeline, startup, user_cache
 
 logger = logging.getLogger(__name__)
 
-LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 LINE_CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET")
+# Shops listed per key in the 確認 reply
+CHECK_PREVIEW_SHOPS = 5
+# 確認 holds a webhook slot and a reply token, so uncached fetches give up after this long
+CHECK_DEADLINE_SECONDS = float(os.getenv("CHECK_DEADLINE_SECONDS", "10"))
 
-LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
-LINE_CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET")
-
-if LINE_CHANNEL_ACCESS_TOKEN:
-    line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-else:
-    line_bot_api = None
-    logger.warning("LINE_CHANNEL_ACCESS_TOKEN is not set.")
-
+# Built once at import; parsing only needs the channel secret
 if LINE_CHANNEL_SECRET:
-    handler = WebhookHandler(LINE_CHANNEL_SECRET)
+    parser = WebhookParser(LINE_CHANNEL_SECRET)
 else:
-    handler = None
+    parser = None
     logger.warning("LINE_CHANNEL_SECRET is not set.")
 
-async def handle_webhook(request: Request, db: Session, background_tasks: BackgroundTasks):
+async def reply(event, text: str):
+    # The SDK call is blocking, so run it on a worker thread instead of the event loop
+    line_bot_api = line_client.get_line_bot_api()
+    if line_bot_api:
+        await line_dispatcher.call_with_retry(line_bot_api.reply_message, event.reply_token, TextSendMessage(text=text))
+
+async def handle_webhook(request: Request):
+    with metrics.WEBHOOK_LATENCY.time():
+        return await _handle_webhook(request)
+
+async def _handle_webhook(request: Request):
     signature = request.headers.get("X-Line-Signature", "")
     body = await request.body()
     body_str = body.decode("utf-8")
 
+    if parser is None:
+        raise HTTPException(status_code=500, detail="LINE_CHANNEL_SECRET is not set")
+
     try:
-        # We need to pass the db session to the handler, but the standard handler doesn't support extra args.
-        # So we'll handle the events manually or wrap the handler.
-        # A simple way is to process events in a loop after parsing.
-        
-        # However, line-bot-sdk's handler.handle() calls the registered functions.
-        # We can use a global variable or a context var, but that's messy.
-        # Better approach: Parse the body manually using the parser provided by the SDK, 
-        # then iterate over events.
-        
-        from linebot.models import Event
-        from linebot.webhook import WebhookParser
-        
-        parser = WebhookParser(LINE_CHANNEL_SECRET)
         events = parser.parse(body_str, signature)
-
-        for event in events:
-            if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
-                await handle_message(event, db)
-
     except InvalidSignatureError:
         raise HTTPException(status_code=400, detail="Invalid signature")
     except Exception as e:
         logger.error(f"Error handling webhook: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+    # Acknowledge right away; slow responses make LINE redeliver the same events
+    for event in events:
+        if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+            event_dispatcher.submit(event.source.user_id, event.webhook_event_id, event)
+
     return "OK"
 
-async def handle_message(event: MessageEvent, db: Session):
+async def process_event(event: MessageEvent):
+    # Runs after the request has finished, so it needs its own session
+    async with database.AsyncSessionLocal() as db:
+        await handle_message(event, db)
+
+event_dispatcher = webhook_pipeline.EventDispatcher(process_event)
+
+async def handle_message(event: MessageEvent, db: AsyncSession):
     text = event.message.text.strip()
     line_user_id = event.source.user_id
     
-    # Ensure user exists
-    user = crud.get_user_by_line_id(db, line_user_id)
-    if not user:
-        user = crud.create_user(db, line_user_id)
-
-    if text.startswith("登録"):
-        await handle_register(event, text, user, db)
-    elif text == "一覧":
-        await handle_list(event, user, db)
-    elif text.startswith("削除"):
-        await handle_delete(event, text, user, db)
-    else:
+    # Ensure user exists; repeat users are served from the cache
+    user = await user_cache.users.get_user(db, line_user_id)
+
+    parsed = commands.parse(text)
+    if parsed is None:
         # Echo or help message
         reply_text = (
             "【使い方ガイド】\n\n"
             "🤖 監視を登録する\n"
             "「登録 {都道府県} {商品URL}」\n"
-            "例：登録 東京 https://gashapon.jp/products/detail.php?jan_code=...\n\n"
+            "例：登録 東京 https://gashapon.jp/products/detail.php?jan_code=...\n"
+            "※「関東」「関西」などの地方名で、まとめて登録できます。\n\n"
             "📋 登録リストを見る\n"
             "「一覧」\n\n"
+            "🔍 今すぐ在庫を確認する\n"
+            "「確認」\n\n"
             "🗑️ 登録を削除する\n"
             "「削除 {監視ID}」\n"
             "※IDは一覧コマンドで確認できます。"
         )
-        if line_bot_api:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
-
-async def handle_register(event, text, user, db):
-    # Format: 登録 {Prefecture} {URL}
-    parts = text.split()
-    if len(parts) != 3:
-        if line_bot_api:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="フォーマットエラー: 登録 {都道府県} {商品URL}"))
-        return
-
-    pref_input = parts[1]
-    url = parts[2]
-    
-    # Normalize prefecture
-    normalized_pref = None
-    for p in scraper.PREFECTURE_MAP.keys():
-        if pref_input in p: # Simple matching (e.g. "東京" in "東京都")
-            normalized_pref = p
-            break
-    
-    if not normalized_pref:
-        if line_bot_api:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"都道府県が見つかりません: {pref_input}"))
+        await reply(event, reply_text)
+    elif parsed.args is None:
+        await reply(event, f"フォーマットエラー: {commands.usage(parsed.name)}")
+    else:
+        await COMMAND_HANDLERS[parsed.name](event, parsed.args, user, db)
+
+async def handle_register(event, args, user, db):
+    area, url = args
+    # A prefecture resolves to one name, a region such as 関東 to several
+    prefecture_names = prefectures.resolve(area)
+    if not prefecture_names:
+        await reply(event, f"都道府県が見つかりません: {area}")
         return
 
-    # Extract product code
-    # URL example: 
-    # https://gashapon.jp/shop/gplus_list.php?product_code=XXXXXX
-    # https://gashapon.jp/products/detail.php?jan_code=XXXXXX
-    match = re.search(r"(?:product_code|jan_code)=([a-zA-Z0-9]+)", url)
+    match = commands.PRODUCT_CODE_RE.search(url)
     if not match:
-        if line_bot_api:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="URLから商品コード(product_code または jan_code)を抽出できませんでした。"))
+        await reply(event, "URLから商品コード(product_code または jan_code)を抽出できませんでした。")
         return
     
     product_code = match.group(1)
-    
-    crud.create_watch(db, user.id, normalized_pref, url, product_code)
-    
-    reply_text = f"{normalized_pref} × {product_code} を監視登録しました。"
-    if line_bot_api:
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
 
-async def handle_list(event, user, db):
-    watches = crud.get_watches_by_user(db, user.id)
+    # Duplicates are caught from the cached watch set without touching the database
+    await user_cache.users.get_watches(db, user)
+    new_names = [name for name in prefecture_names if not user.find_watch(product_code, name)]
+    if not new_names:
+        label = prefecture_names[0] if len(prefecture_names) == 1 else area
+        await reply(event, f"{label} × {product_code} はすでに監視登録されています。")
+        return
+
+    for watch in await async_crud.create_watches(db, user.id, new_names, url, product_code):
+        user_cache.users.add_watch(user, watch)
+
+    if len(prefecture_names) == 1:
+        reply_text = f"{new_names[0]} × {product_code} を監視登録しました。"
+    else:
+        reply_text = f"{area}（{'、'.join(new_names)}）× {product_code} を監視登録しました。"
+        skipped = len(prefecture_names) - len(new_names)
+        if skipped:
+            reply_text += f"\n登録済みの {skipped} 件はスキップしました。"
+    await reply(event, reply_text)
+
+async def handle_list(event, args, user, db):
+    watches = list((await user_cache.users.get_watches(db, user)).values())
     if not watches:
-        if line_bot_api:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="監視中の商品はありません。"))
+        await reply(event, "監視中の商品はありません。")
         return
     
     lines = ["【監視リスト】"]
     for w in watches:
         lines.append(f"ID: {w.id}\n地域: {w.prefecture}\nコード: {w.product_code}\n---")
     
-    if line_bot_api:
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="\n".join(lines)))
+    await reply(event, "\n".join(lines))
 
-async def handle_delete(event, text, user, db):
-    parts = text.split()
-    if len(parts) != 2:
-        if line_bot_api:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="フォーマットエラー: 削除 {監視ID}"))
-        return
-    
-    watch_id_str = parts[1]
+async def handle_delete(event, args, user, db):
+    watch_id_str, = args
     try:
         watch_id = models.uuid.UUID(watch_id_str)
     except ValueError:
-        if line_bot_api:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="無効なID形式です。"))
+        await reply(event, "無効なID形式です。")
         return
 
-    success = crud.delete_watch(db, watch_id, user.id)
+    watches = await user_cache.users.get_watches(db, user)
+    success = watch_id in watches and await async_crud.delete_watch(db, watch_id, user.id)
     if success:
-        if line_bot_api:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="削除しました。"))
+        user_cache.users.remove_watch(user, watch_id)
+        await reply(event, "削除しました。")
     else:
-        if line_bot_api:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="該当する監視設定が見つかりません。"))
+        # Possibly deleted by another process; reload the watch set next time
+        user_cache.users.invalidate(event.source.user_id)
+        await reply(event, "該当する監視設定が見つかりません。")
+
+async def handle_check(event, args, user, db):
+    watches = list((await user_cache.users.get_watches(db, user)).values())
+    if not watches:
+        await reply(event, "監視中の商品はありません。")
+        return
+
+    # Recent crawl results answer instantly; other keys are fetched once even if several users ask
+    result_cache = startup.load("app.result_cache")
+    http_client = startup.load("app.http_client")
+    keys = list(dict.fromkeys((w.product_code, w.prefecture) for w in watches))
+    # Only a preview is shown, so uncached keys stop downloading once it is filled. The
+    # deadline bounds timeouts and retries; wait_for also covers waiting on the rate limiter.
+    with http_client.deadline(CHECK_DEADLINE_SECONDS):
+        results = await asyncio.gather(
+            *(asyncio.wait_for(result_cache.preview_shops(code, pref, CHECK_PREVIEW_SHOPS), CHECK_DEADLINE_SECONDS) for code, pref in keys),
+            return_exceptions=True
+        )
+    shops_by_key = dict(zip(keys, results))
+
+    lines = ["【在庫確認】"]
+    for code, pref in keys:
+        result = shops_by_key[(code, pref)]
+        if isinstance(result, Exception):
+            lines.append(f"\n{pref} × {code}: 取得に失敗しました。しばらくしてから再度お試しください。")
+            continue
+        shops, total = result
+        if total is None:
+            lines.append(f"\n{pref} × {code}: {CHECK_PREVIEW_SHOPS + 1} 件以上")
+        else:
+            lines.append(f"\n{pref} × {code}: {total} 件")
+        for shop in shops:
+            lines.append(f"・{shop['name']}")
+        if total is None:
+            lines.append("他にも在庫のある店舗があります...")
+        elif total > CHECK_PREVIEW_SHOPS:
+            lines.append(f"他 {total - CHECK_PREVIEW_SHOPS} 件...")
+
+    await reply(event, "\n".join(lines)[:5000])
+
+COMMAND_HANDLERS = {
+    "register": handle_register,
+    "list": handle_list,
+    "delete": handle_delete,
+    "check": handle_check,
+}
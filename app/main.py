@@ -1,28 +1,76 @@
 import os
+import sys
 import logging
-from fastapi import FastAPI, Request, Depends, HTTPException, Header, BackgroundTasks
-from sqlalchemy.orm import Session
-from . import database, models, line_handlers, crawl_task
+import asyncio
+from fastapi import FastAPI, Request, HTTPException, Header, BackgroundTasks, Response
+from . import database, line_handlers, metrics, startup
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Create tables (for simplicity in this setup, usually handled by Alembic)
-models.Base.metadata.create_all(bind=database.engine)
+# Migrations normally run once per deploy (`python -m app.schema`); on startup only a
+# cheap "is the database at head" check runs, migrating if a pre-deploy step was skipped
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+# Read here rather than from app.scheduler so a disabled scheduler never imports the crawl stack
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "false").lower() == "true"
+# Only needed by crawls, ticks, retention and 確認; imported on first use when LAZY_INIT is on
+CRAWL_STACK = ("app.result_cache", "app.crawl_task", "app.retention", "app.scheduler")
+
+if MIGRATE_ON_STARTUP:
+    startup.load("app.schema").ensure_migrated()
+
+startup.mark("app_imported")
 
 app = FastAPI()
 
+scheduler_task = None
+
+async def start_scheduler():
+    # Imported on a worker thread so the first webhook is not stuck behind the crawl stack
+    scheduler = await asyncio.to_thread(startup.load, "app.scheduler")
+    await scheduler.scheduler.run_forever()
+
+@app.on_event("startup")
+async def on_startup():
+    global scheduler_task
+    if not startup.LAZY_INIT:
+        for name in CRAWL_STACK:
+            startup.load(name)
+    if SCHEDULER_ENABLED:
+        scheduler_task = asyncio.create_task(start_scheduler())
+    startup.mark("app_ready")
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if scheduler_task:
+        scheduler_task.cancel()
+    # Nothing to close if no fetch ever happened
+    http_client = sys.modules.get("app.http_client")
+    if http_client:
+        await http_client.close_client()
+    await database.async_engine.dispose()
+
+@app.middleware("http")
+async def record_first_response(request: Request, call_next):
+    response = await call_next(request)
+    startup.mark("first_response")
+    return response
+
 @app.get("/health")
 def health_check():
     return "ok"
 
+@app.get("/metrics")
+def get_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
 @app.post("/webhook/line")
-async def line_webhook(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(database.get_db)):
-    return await line_handlers.handle_webhook(request, db, background_tasks)
+async def line_webhook(request: Request):
+    return await line_handlers.handle_webhook(request)
 
-@app.post("/cron/crawl")
-async def cron_crawl(background_tasks: BackgroundTasks, authorization: str = Header(None), db: Session = Depends(database.get_db)):
+def verify_cron_secret(authorization: str):
     cron_secret = os.getenv("CRON_SECRET")
     
     # Simple bearer token check or just matching the secret
@@ -35,5 +83,34 @@ async def cron_crawl(background_tasks: BackgroundTasks, authorization: str = Hea
     elif authorization != f"Bearer {cron_secret}":
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    background_tasks.add_task(crawl_task.run_crawl_task, db)
+@app.post("/cron/crawl")
+async def cron_crawl(background_tasks: BackgroundTasks, authorization: str = Header(None)):
+    verify_cron_secret(authorization)
+    # The crawl outlives the request, so it opens its own session
+    crawl_task = startup.load("app.crawl_task")
+    background_tasks.add_task(crawl_task.run_crawl_task)
     return {"status": "accepted", "message": "Crawl task started"}
+
+@app.post("/cron/retention")
+async def cron_retention(background_tasks: BackgroundTasks, authorization: str = Header(None)):
+    verify_cron_secret(authorization)
+    retention = startup.load("app.retention")
+    background_tasks.add_task(retention.run_retention_job)
+    return {"status": "accepted", "message": "Retention job started"}
+
+@app.post("/cron/tick")
+async def cron_tick(background_tasks: BackgroundTasks, authorization: str = Header(None)):
+    verify_cron_secret(authorization)
+    scheduler = startup.load("app.scheduler")
+    background_tasks.add_task(scheduler.scheduler.tick)
+    return {"status": "accepted", "message": "Scheduler tick started"}
+
+@app.get("/schedule")
+def get_schedule(authorization: str = Header(None)):
+    verify_cron_secret(authorization)
+    return startup.load("app.scheduler").scheduler.describe()
+
+@app.get("/startup")
+def get_startup(authorization: str = Header(None)):
+    verify_cron_secret(authorization)
+    return startup.report()
@@ -0,0 +1,48 @@
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+FETCH_LATENCY = Histogram(
+    "gashapon_fetch_seconds", "Upstream fetch latency", ["status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+FETCH_FAILURES = Counter("gashapon_fetch_failures_total", "Fetches that failed after retries", ["reason"])
+CIRCUIT_OPEN = Gauge("gashapon_circuit_open", "1 while the host's circuit breaker is open", ["host"])
+FETCH_BYTES = Counter("gashapon_fetch_bytes_total", "Response bytes downloaded from upstream")
+PARSE_LATENCY = Histogram(
+    "gashapon_parse_seconds", "parse_shops duration",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+SHOPS_FOUND = Histogram(
+    "gashapon_shops_found", "Shops found per fetch",
+    buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+LINE_LATENCY = Histogram(
+    "line_api_seconds", "LINE API call latency", ["operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+LINE_FAILURES = Counter("line_api_failures_total", "Failed LINE API calls", ["operation"])
+DB_LATENCY = Histogram(
+    "db_query_seconds", "Database query latency",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1),
+)
+WEBHOOK_LATENCY = Histogram(
+    "webhook_seconds", "LINE webhook handling latency",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+)
+WEBHOOK_EVENT_LATENCY = Histogram(
+    "webhook_event_seconds", "Background processing time per webhook event",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+WEBHOOK_DUPLICATES = Counter("webhook_duplicates_total", "Redelivered webhook events that were dropped")
+CRAWL_DURATION = Histogram(
+    "crawl_seconds", "Duration of one crawl worker drain",
+    buckets=(1, 5, 15, 30, 60, 300, 900, 1800, 3600),
+)
+STARTUP_SECONDS = Gauge("startup_seconds", "Seconds from process start to each startup stage", ["stage"])
+MODULE_LOAD_SECONDS = Gauge("module_load_seconds", "Time spent importing a lazily loaded module", ["module"])
+
+
+def render():
+    """
+    Returns the (body, content type) of the Prometheus exposition for /metrics.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, DateTime, ForeignKey, Text, UniqueConstraint, Index, Integer, Float, BigInteger, SmallInteger, Boolean, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -18,6 +18,10 @@ class User(Base):
 
 class Watch(Base):
     __tablename__ = "watches"
+    __table_args__ = (
+        Index("ix_watches_user_id", "user_id"),
+        Index("ix_watches_product_code_prefecture", "product_code", "prefecture"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -33,10 +37,109 @@ class Watch(Base):
 
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (Index("ix_notifications_watch_id_notified_at", "watch_id", "notified_at"),)
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     watch_id = Column(UUID(as_uuid=True), ForeignKey("watches.id"), nullable=False)
     notified_at = Column(DateTime(timezone=True), server_default=func.now())
-    payload_json = Column(Text, nullable=True)
+    payload_json = Column(Text, nullable=True)  # Legacy full payload, replaced by shop id references
+    shop_ids = Column(Text, nullable=True)  # JSON list of shops.id that came into stock
+    removed_shop_ids = Column(Text, nullable=True)  # JSON list of shops.id that went out of stock
 
     watch = relationship("Watch", back_populates="notifications")
+
+
+class StockSnapshot(Base):
+    __tablename__ = "stock_snapshots"
+    __table_args__ = (UniqueConstraint("product_code", "prefecture", name="uq_stock_snapshots_product_prefecture"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    product_code = Column(String, nullable=False)
+    prefecture = Column(String, nullable=False)
+    fingerprint = Column(String(40), nullable=False)
+    shop_keys = Column(Text, nullable=False)  # JSON list of sorted "name|address" keys
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    # Adaptive polling state, see snapshots.record_poll
+    poll_interval = Column(Integer, nullable=True)  # seconds
+    last_crawled_at = Column(DateTime(timezone=True), nullable=True)
+    last_changed_at = Column(DateTime(timezone=True), nullable=True)
+    next_crawl_at = Column(DateTime(timezone=True), nullable=True, index=True)
+
+
+class Shop(Base):
+    __tablename__ = "shops"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    shop_key = Column(String, unique=True, index=True, nullable=False)  # "name|address"
+    name = Column(String, nullable=False)
+    address = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class StockEvent(Base):
+    """
+    Append-only stock history: one narrow row each time a shop appears in or
+    disappears from a (product_code, prefecture) shop list. See stock_history.
+    """
+    __tablename__ = "stock_events"
+    __table_args__ = (
+        Index("ix_stock_events_key_observed_at", "product_code", "pref_code", "observed_at"),
+        Index("ix_stock_events_shop_id_observed_at", "shop_id", "observed_at"),
+    )
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    observed_at = Column(DateTime(timezone=True), nullable=False)
+    product_code = Column(String, nullable=False)
+    pref_code = Column(SmallInteger, nullable=False)  # prefectures.PREFECTURE_MAP code as a number
+    shop_id = Column(Integer, ForeignKey("shops.id"), nullable=False)
+    in_stock = Column(Boolean, nullable=False)  # True when the shop appeared, False when it went away
+
+
+class CrawlItem(Base):
+    """
+    One (product_code, prefecture) key to crawl. Workers lease pending items in batches;
+    an item whose lease expired is claimable again.
+    """
+    __tablename__ = "crawl_items"
+    __table_args__ = (
+        # At most one active item per key, so overlapping triggers do not enqueue twice
+        Index(
+            "uq_crawl_items_active_key", "product_code", "prefecture", unique=True,
+            postgresql_where=text("status IN ('pending', 'leased')"),
+            sqlite_where=text("status IN ('pending', 'leased')"),
+        ),
+        Index("ix_crawl_items_status_id", "status", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(String, nullable=False)
+    product_code = Column(String, nullable=False)
+    prefecture = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, leased, done
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Upstream requests (pages and retries) spent on this item across all attempts
+    requests = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class CrawlRun(Base):
+    """
+    Summary of one crawl worker drain, written when it finishes.
+    """
+    __tablename__ = "crawl_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    worker = Column(String, nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=False)
+    requests = Column(Integer, nullable=False, default=0)
+    shops_found = Column(Integer, nullable=False, default=0)
+    changed_keys = Column(Integer, nullable=False, default=0)
+    notifications_sent = Column(Integer, nullable=False, default=0)
+    fetch_failures = Column(Integer, nullable=False, default=0)
+    push_failures = Column(Integer, nullable=False, default=0)
+    db_queries = Column(Integer, nullable=False, default=0)
+    db_seconds = Column(Float, nullable=False, default=0)
@@ -0,0 +1,84 @@
+"""
+Prefecture names and the area codes gashapon.jp uses for them. Kept free of
+heavy imports so the webhook path can use it without loading the scraper.
+"""
+import unicodedata
+
+PREFECTURE_MAP = {
+    "北海道": "01", "青森県": "02", "岩手県": "03", "宮城県": "04", "秋田県": "05", "山形県": "06", "福島県": "07",
+    "茨城県": "08", "栃木県": "09", "群馬県": "10", "埼玉県": "11", "千葉県": "12", "東京都": "13", "神奈川県": "14",
+    "新潟県": "15", "富山県": "16", "石川県": "17", "福井県": "18", "山梨県": "19", "長野県": "20",
+    "岐阜県": "21", "静岡県": "22", "愛知県": "23", "三重県": "24", "滋賀県": "25", "京都府": "26",
+    "大阪府": "27", "兵庫県": "28", "奈良県": "29", "和歌山県": "30", "鳥取県": "31", "島根県": "32",
+    "岡山県": "33", "広島県": "34", "山口県": "35", "徳島県": "36", "香川県": "37", "愛媛県": "38", "高知県": "39",
+    "福岡県": "40", "佐賀県": "41", "長崎県": "42", "熊本県": "43", "大分県": "44", "宮崎県": "45", "鹿児島県": "46",
+    "沖縄県": "47"
+}
+
+PREFECTURE_NAMES = {code: name for name, code in PREFECTURE_MAP.items()}
+
+PREFECTURE_ROMAJI = (
+    "hokkaido", "aomori", "iwate", "miyagi", "akita", "yamagata", "fukushima",
+    "ibaraki", "tochigi", "gunma", "saitama", "chiba", "tokyo", "kanagawa",
+    "niigata", "toyama", "ishikawa", "fukui", "yamanashi", "nagano",
+    "gifu", "shizuoka", "aichi", "mie", "shiga", "kyoto",
+    "osaka", "hyogo", "nara", "wakayama", "tottori", "shimane",
+    "okayama", "hiroshima", "yamaguchi", "tokushima", "kagawa", "ehime", "kochi",
+    "fukuoka", "saga", "nagasaki", "kumamoto", "oita", "miyazaki", "kagoshima",
+    "okinawa",
+)
+
+
+def _span(first: int, last: int) -> tuple:
+    return tuple(f"{code:02d}" for code in range(first, last + 1))
+
+
+# Region name -> (romaji, prefecture codes)
+REGIONS = {
+    "東北": ("tohoku", _span(2, 7)),
+    "関東": ("kanto", _span(8, 14)),
+    "中部": ("chubu", _span(15, 23)),
+    "北陸": ("hokuriku", _span(15, 18)),
+    "甲信越": ("koshinetsu", ("15", "19", "20")),
+    "東海": ("tokai", _span(21, 24)),
+    "近畿": ("kinki", _span(24, 30)),
+    "関西": ("kansai", _span(25, 30)),
+    "中国": ("chugoku", _span(31, 35)),
+    "四国": ("shikoku", _span(36, 39)),
+    "九州": ("kyushu", _span(40, 46)),
+}
+
+
+def normalize(text: str) -> str:
+    # Full-width letters and case differences should not matter
+    return unicodedata.normalize("NFKC", text).strip().casefold()
+
+
+def _build_alias_index() -> dict:
+    index = {}
+    for (name, code), romaji in zip(PREFECTURE_MAP.items(), PREFECTURE_ROMAJI):
+        index[name] = (code,)
+        index[romaji] = (code,)
+        short = name[:-1] if name[-1] in "都府県" else name
+        index[short] = (code,)
+    for name, (romaji, codes) in REGIONS.items():
+        for alias in (name, name + "地方", romaji):
+            index[alias] = codes
+    return {normalize(alias): codes for alias, codes in index.items()}
+
+
+# Every accepted spelling -> prefecture codes, built once at import
+ALIAS_INDEX = _build_alias_index()
+_ALIAS_NAMES = {alias: tuple(PREFECTURE_NAMES[code] for code in codes) for alias, codes in ALIAS_INDEX.items()}
+
+
+def resolve(text: str) -> tuple:
+    """
+    Returns the prefecture names an area name refers to: one for a prefecture
+    (東京, 東京都, tokyo), several for a region (関東), none if unknown.
+    """
+    # Most input is already in normalized form, so try it as-is first
+    names = _ALIAS_NAMES.get(text)
+    if names is None:
+        names = _ALIAS_NAMES.get(normalize(text), ())
+    return names
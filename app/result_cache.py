@@ -0,0 +1,92 @@
+import os
+import asyncio
+import logging
+from . import scraper
+from .ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+
+
+class ResultCache(TTLCache):
+    """
+    Bounded TTL + LRU cache of fetch results. Concurrent lookups of the same missing
+    key share a single fetch (single-flight).
+    """
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL):
+        super().__init__(maxsize, ttl)
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_fetch(self, key, fetch):
+        """
+        Returns the cached value for key, or awaits fetch() once for all concurrent callers.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        future = self.inflight.get(key)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved so a failure without waiters is not logged as unhandled
+            future.exception()
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self.inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "inflight": len(self.inflight),
+        }
+
+
+# Shop lists keyed by (product_code, prefecture), shared by the crawl and user queries
+shop_cache = ResultCache()
+
+
+async def fetch_shops_cached(product_code: str, prefecture: str):
+    return await shop_cache.get_or_fetch((product_code, prefecture), lambda: scraper.fetch_shops(product_code, prefecture))
+
+
+async def preview_shops(product_code: str, prefecture: str, count: int):
+    """
+    Returns (the first `count` shops, total number of shops or None if there are more
+    than `count`). A cached full list answers with an exact total; otherwise the fetch
+    stops as soon as it has seen count + 1 shops.
+    """
+    shops = shop_cache.get((product_code, prefecture))
+    if shops is not None:
+        shop_cache.hits += 1
+        return shops[:count], len(shops)
+    # Cached separately so a truncated list is never mistaken for the full one
+    shops = await shop_cache.get_or_fetch(
+        (product_code, prefecture, count + 1),
+        lambda: scraper.fetch_shops(product_code, prefecture, limit=count + 1)
+    )
+    return shops[:count], len(shops) if len(shops) <= count else None
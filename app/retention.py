@@ -0,0 +1,124 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import async_crud, models, database, snapshots, crawl_queue
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
+STOCK_HISTORY_RETENTION_DAYS = int(os.getenv("STOCK_HISTORY_RETENTION_DAYS", "365"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+
+
+def prune_notifications(db: Session, retention_days: int = NOTIFICATION_RETENTION_DAYS, batch_size: int = RETENTION_BATCH_SIZE):
+    """
+    Deletes notifications older than retention_days, one batch per transaction so
+    the table is never locked for long. Returns the number of rows deleted.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        ids = [
+            row.id for row in db.query(models.Notification.id)
+            .filter(models.Notification.notified_at < cutoff)
+            .limit(batch_size)
+        ]
+        if not ids:
+            break
+        db.query(models.Notification).filter(models.Notification.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+    return deleted
+
+
+def prune_stock_events(db: Session, retention_days: int = STOCK_HISTORY_RETENTION_DAYS, batch_size: int = RETENTION_BATCH_SIZE):
+    """
+    Deletes stock events older than retention_days, one batch per transaction.
+    The table is append-only, so walking it in id order reaches the oldest rows first.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        ids = [
+            row.id for row in db.query(models.StockEvent.id)
+            .filter(models.StockEvent.observed_at < cutoff)
+            .order_by(models.StockEvent.id)
+            .limit(batch_size)
+        ]
+        if not ids:
+            break
+        db.query(models.StockEvent).filter(models.StockEvent.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+    return deleted
+
+
+async def compact_legacy_payloads(db: AsyncSession, batch_size: int = RETENTION_BATCH_SIZE):
+    """
+    Rewrites notifications that still carry a full payload_json into shop id
+    references, one batch per transaction. Returns the number of rows compacted.
+    """
+    compacted = 0
+    while True:
+        notifications = (await db.scalars(
+            select(models.Notification)
+            .filter(models.Notification.payload_json.isnot(None))
+            .limit(batch_size)
+        )).all()
+        if not notifications:
+            break
+
+        payloads = {}
+        shops = {}
+        for notification in notifications:
+            try:
+                payload = json.loads(notification.payload_json)
+            except ValueError:
+                payload = {}
+            payloads[notification.id] = payload
+            for shop in payload.get("shops", []):
+                shops[snapshots.shop_key(shop)] = shop
+            for key in payload.get("removed", []):
+                name, _, address = key.partition("|")
+                shops.setdefault(key, {"name": name, "address": address})
+
+        shop_ids = await async_crud.get_or_create_shop_ids(db, shops)
+        for notification in notifications:
+            payload = payloads[notification.id]
+            notification.shop_ids = json.dumps([shop_ids[snapshots.shop_key(shop)] for shop in payload.get("shops", [])])
+            notification.removed_shop_ids = json.dumps([shop_ids[key] for key in payload.get("removed", [])])
+            notification.payload_json = None
+        await db.commit()
+        compacted += len(notifications)
+    return compacted
+
+
+async def run_retention_job():
+    async with database.AsyncSessionLocal() as db:
+        compacted = await compact_legacy_payloads(db)
+        deleted = await db.run_sync(prune_notifications)
+        crawl_items = await db.run_sync(crawl_queue.prune_done_items)
+        stock_events = await db.run_sync(prune_stock_events)
+        logger.info(
+            f"Retention job: compacted {compacted} notifications, pruned {deleted} older than "
+            f"{NOTIFICATION_RETENTION_DAYS} days, {crawl_items} finished crawl items and "
+            f"{stock_events} stock events older than {STOCK_HISTORY_RETENTION_DAYS} days"
+        )
+        return {"compacted": compacted, "deleted": deleted, "crawl_items": crawl_items, "stock_events": stock_events}
+
+
+async def _main():
+    try:
+        await run_retention_job()
+    finally:
+        await database.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
@@ -0,0 +1,121 @@
+import os
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.orm import Session
+from . import models, database, crawl_queue, crawl_task
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "false").lower() == "true"
+# Seconds between scheduler ticks while the service is running
+SCHEDULER_TICK_SECONDS = int(os.getenv("SCHEDULER_TICK_SECONDS", "300"))
+# Global budget of upstream requests (pages and retries) per hour, shared by all
+# processes via the request counts recorded on crawl_items
+CRAWL_REQUESTS_PER_HOUR = int(os.getenv("CRAWL_REQUESTS_PER_HOUR", "600"))
+
+
+class CrawlScheduler:
+    """
+    Priority queue of (next_crawl_at, key). Keys that were never crawled are due
+    immediately; the rest follow the adaptive interval stored on their snapshot.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.snapshots = {}
+        self._lock = asyncio.Lock()
+
+    def load(self, db: Session):
+        self.heap, self.snapshots = self._build(db)
+
+    @staticmethod
+    def _build(db: Session) -> tuple:
+        """
+        Returns a fresh (heap, snapshots by key) from the database without touching scheduler state.
+        """
+        keys = db.query(models.Watch.product_code, models.Watch.prefecture).distinct().all()
+        snapshots = {(s.product_code, s.prefecture): s for s in db.query(models.StockSnapshot).all()}
+        epoch = datetime.min.replace(tzinfo=timezone.utc)
+
+        heap = []
+        for key in keys:
+            snapshot = snapshots.get(tuple(key))
+            next_at = database.as_utc(snapshot.next_crawl_at) if snapshot and snapshot.next_crawl_at else epoch
+            heap.append((next_at, tuple(key)))
+        heapq.heapify(heap)
+        return heap, snapshots
+
+    def pop_due(self, now: datetime, limit: int) -> list:
+        due = []
+        while self.heap and len(due) < limit and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[1])
+        return due
+
+    @staticmethod
+    def upcoming(heap: list, snapshots: dict, limit: int = 50) -> list:
+        entries = []
+        for next_at, (product_code, prefecture) in heapq.nsmallest(limit, heap):
+            snapshot = snapshots.get((product_code, prefecture))
+            entries.append({
+                "product_code": product_code,
+                "prefecture": prefecture,
+                "next_crawl_at": next_at.isoformat() if next_at.year > 1 else None,
+                "poll_interval": snapshot.poll_interval if snapshot else None,
+                "last_changed_at": snapshot.last_changed_at.isoformat() if snapshot and snapshot.last_changed_at else None,
+            })
+        return entries
+
+    def remaining_budget(self, db: Session, now: datetime) -> int:
+        used = crawl_queue.count_requests_since(db, now - timedelta(hours=1))
+        return max(0, CRAWL_REQUESTS_PER_HOUR - used)
+
+    async def tick(self) -> int:
+        """
+        Enqueues the keys that are due, within the hourly budget, and crawls them.
+        A key costs at least one request, so at most `budget` keys are enqueued;
+        keys that take more pages or retries draw down the budget of later ticks.
+        Returns the number of keys enqueued.
+        """
+        async with self._lock:
+            async with database.AsyncSessionLocal() as db:
+                now = datetime.now(timezone.utc)
+                await db.run_sync(self.load)
+                budget = await db.run_sync(self.remaining_budget, now)
+                due = self.pop_due(now, budget)
+                if not due:
+                    logger.info(f"Scheduler tick: nothing due ({budget} requests left this hour)")
+                    return 0
+
+                logger.info(f"Scheduler tick: {len(due)} keys due ({budget} requests left this hour)")
+                _, enqueued = await db.run_sync(crawl_queue.enqueue_keys, due)
+            await crawl_task.drain_queue()
+            return enqueued
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Scheduler tick failed: {e}")
+            await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+
+    def describe(self) -> dict:
+        # Runs on a threadpool thread while tick() may be using self.heap, so report from a local copy
+        db = database.SessionLocal()
+        try:
+            now = datetime.now(timezone.utc)
+            heap, snapshots = self._build(db)
+            return {
+                "now": now.isoformat(),
+                "keys": len(heap),
+                "requests_per_hour": CRAWL_REQUESTS_PER_HOUR,
+                "remaining_budget": self.remaining_budget(db, now),
+                "upcoming": self.upcoming(heap, snapshots),
+            }
+        finally:
+            db.close()
+
+
+scheduler = CrawlScheduler()
@@ -0,0 +1,78 @@
+import os
+import re
+import logging
+from sqlalchemy import inspect, text
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALEMBIC_INI = os.path.join(ROOT_DIR, "alembic.ini")
+MIGRATIONS_DIR = os.path.join(ROOT_DIR, "migrations", "versions")
+# Revision matching the tables the old create_all() bootstrap produced
+LEGACY_REVISION = "0001"
+
+_REVISION_RE = re.compile(r"^(revision|down_revision)\s*=\s*[\"']?(\w+)", re.MULTILINE)
+
+
+def run_migrations():
+    """
+    Upgrades the database to the latest Alembic revision. Databases created by the
+    old create_all() bootstrap are stamped at the baseline revision first.
+    """
+    # Alembic takes about half a second to import, so only pay for it when migrating
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(ALEMBIC_INI)
+    config.attributes["configure_logger"] = False
+
+    inspector = inspect(engine)
+    if inspector.has_table("users") and not inspector.has_table("alembic_version"):
+        logger.info(f"Stamping existing schema at revision {LEGACY_REVISION}")
+        command.stamp(config, LEGACY_REVISION)
+
+    command.upgrade(config, "head")
+
+
+def head_revisions() -> set:
+    """
+    Head revisions of migrations/versions, read from the files without importing Alembic.
+    """
+    revisions, parents = set(), set()
+    for name in os.listdir(MIGRATIONS_DIR):
+        if not name.endswith(".py"):
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+            fields = dict(_REVISION_RE.findall(f.read()))
+        if "revision" in fields:
+            revisions.add(fields["revision"])
+        if fields.get("down_revision", "None") != "None":
+            parents.add(fields["down_revision"])
+    return revisions - parents
+
+
+def is_at_head() -> bool:
+    if not inspect(engine).has_table("alembic_version"):
+        return False
+    with engine.connect() as conn:
+        current = {row[0] for row in conn.execute(text("SELECT version_num FROM alembic_version"))}
+    return current == head_revisions()
+
+
+def ensure_migrated() -> bool:
+    """
+    Migrates only when the database is behind, so a start that skipped the
+    pre-deploy step (local runs, crawl workers) still gets its tables while an
+    up-to-date database costs one query. Returns whether migrations ran.
+    """
+    if is_at_head():
+        return False
+    logger.info("Database schema is behind, running migrations")
+    run_migrations()
+    return True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_migrations()
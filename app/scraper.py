@@ -1,66 +1,228 @@
 import httpx
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import logging
 import asyncio
+import os
+import re
+import hashlib
+from collections import OrderedDict
+import time
+from . import http_client, metrics
+from .prefectures import PREFECTURE_MAP
 
 logger = logging.getLogger(__name__)
 
-PREFECTURE_MAP = {
-    "北海道": "01", "青森県": "02", "岩手県": "03", "宮城県": "04", "秋田県": "05", "山形県": "06", "福島県": "07",
-    "茨城県": "08", "栃木県": "09", "群馬県": "10", "埼玉県": "11", "千葉県": "12", "東京都": "13", "神奈川県": "14",
-    "新潟県": "15", "富山県": "16", "石川県": "17", "福井県": "18", "山梨県": "19", "長野県": "20",
-    "岐阜県": "21", "静岡県": "22", "愛知県": "23", "三重県": "24", "滋賀県": "25", "京都府": "26",
-    "大阪府": "27", "兵庫県": "28", "奈良県": "29", "和歌山県": "30", "鳥取県": "31", "島根県": "32",
-    "岡山県": "33", "広島県": "34", "山口県": "35", "徳島県": "36", "香川県": "37", "愛媛県": "38", "高知県": "39",
-    "福岡県": "40", "佐賀県": "41", "長崎県": "42", "熊本県": "43", "大分県": "44", "宮崎県": "45", "鹿児島県": "46",
-    "沖縄県": "47"
-}
+try:
+    from lxml import etree as lxml_etree, html as lxml_html
+except ImportError:
+    lxml_etree = lxml_html = None
+
+# "fast" (strained, lxml when available) or "html.parser" (full-document parse)
+SHOP_PARSER_BACKEND = os.getenv("SHOP_PARSER_BACKEND", "fast")
+
+GPLUS_LIST_URL = "https://gashapon.jp/shop/gplus_list.php"
+GPLUS_HOST = "gashapon.jp"
+# Long shop lists are split into pages selected with this query parameter
+GPLUS_PAGE_PARAM = "pageno"
+GPLUS_MAX_PAGES = int(os.getenv("GPLUS_MAX_PAGES", "20"))
+# Pager links look like "...?pref=13&amp;pageno=3"
+_PAGE_NUMBER_RE = re.compile(rf"[?&;]{GPLUS_PAGE_PARAM}=(\d+)")
+
+# Per-URL validators and the last parsed result, used to skip re-downloading and re-parsing
+RESPONSE_CACHE_SIZE = 5000
+_response_cache = OrderedDict()
+
+class FetchError(Exception):
+    """
+    The shop list could not be fetched. Distinct from a successful fetch with no shops.
+    """
+
+
+class FetchDeferred(FetchError):
+    """
+    The fetch was not attempted (circuit open or no time left) and should be retried later.
+    """
 
-async def fetch_shops(product_code: str, pref_name: str):
+
+async def fetch_shops(product_code: str, pref_name: str, limit: int = None):
     """
     Scrapes gashapon.jp for shops stocking the product in the given prefecture.
     Returns a list of dictionaries containing shop details.
+    Follow-up pages are fetched concurrently once the first page shows how many
+    there are. With `limit`, downloading and parsing stop as soon as that many
+    shops are in hand and at most `limit` shops are returned.
+    Raises FetchError when the page could not be fetched.
     """
     pref_code = PREFECTURE_MAP.get(pref_name)
     if not pref_code:
         logger.error(f"Invalid prefecture name: {pref_name}")
         return []
 
-    url = "https://gashapon.jp/shop/gplus_list.php"
+    try:
+        shops, page_count = await _fetch_page(product_code, pref_code, 1, limit)
+        if page_count > 1 and (limit is None or len(shops) < limit):
+            remaining = limit - len(shops) if limit is not None else None
+            shops = shops + await _fetch_follow_up_pages(product_code, pref_code, page_count, remaining)
+
+        if limit is not None:
+            return shops[:limit]
+        metrics.SHOPS_FOUND.observe(len(shops))
+        return shops
+
+    except FetchError:
+        raise
+    except http_client.CircuitOpenError as e:
+        metrics.FETCH_FAILURES.labels(reason="circuit_open").inc()
+        raise FetchDeferred(str(e)) from e
+    except http_client.DeadlineExceeded as e:
+        metrics.FETCH_FAILURES.labels(reason="deadline").inc()
+        raise FetchDeferred(str(e)) from e
+    except httpx.HTTPError as e:
+        logger.error(f"HTTP error occurred while fetching shops: {e}")
+        metrics.FETCH_FAILURES.labels(reason="http").inc()
+        raise FetchError(str(e)) from e
+    except Exception as e:
+        logger.error(f"An unexpected error occurred: {e}")
+        metrics.FETCH_FAILURES.labels(reason="unexpected").inc()
+        raise FetchError(str(e)) from e
+
+async def _fetch_follow_up_pages(product_code: str, pref_code: str, page_count: int, limit: int = None):
+    if page_count > GPLUS_MAX_PAGES:
+        logger.warning(f"{product_code} in {pref_code} has {page_count} pages, fetching the first {GPLUS_MAX_PAGES}")
+    tasks = [
+        asyncio.create_task(_fetch_page(product_code, pref_code, page, limit))
+        for page in range(2, min(page_count, GPLUS_MAX_PAGES) + 1)
+    ]
+    shops = []
+    try:
+        # Pages are consumed in order so the list keeps the site's ordering
+        for task in tasks:
+            page_shops, _ = await task
+            shops.extend(page_shops)
+            if limit is not None and len(shops) >= limit:
+                break
+    finally:
+        # Pages that are no longer needed, or that follow a failed one, are dropped
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return shops
+
+async def _fetch_page(product_code: str, pref_code: str, page: int, limit: int = None):
+    """
+    Fetches one page of the shop list and returns (shops, page count shown in its pager).
+    """
+    url = GPLUS_LIST_URL
     params = {
         "pref": pref_code,
         "product_code": product_code
     }
+    if page > 1:
+        params[GPLUS_PAGE_PARAM] = page
     
     headers = {
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
     }
 
+    cache_key = str(httpx.URL(url, params=params))
+    cached = _response_cache.get(cache_key)
+    if cached:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = await http_client.get(url, params=params, headers=headers, stream=True)
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url, params=params, headers=headers)
-            response.raise_for_status()
-            
-            # Check if the response is valid HTML
-            if "text/html" not in response.headers.get("content-type", ""):
-                 logger.error(f"Unexpected content type: {response.headers.get('content-type')}")
-                 return []
+        if response.status_code == 304 and cached:
+            logger.info(f"Not modified: {cache_key}")
+            _response_cache.move_to_end(cache_key)
+            return cached["shops"], cached["page_count"]
+        response.raise_for_status()
 
-            return parse_shops(response.text)
+        # Check if the response is valid HTML
+        if "text/html" not in response.headers.get("content-type", ""):
+             logger.error(f"Unexpected content type: {response.headers.get('content-type')}")
+             metrics.FETCH_FAILURES.labels(reason="content_type").inc()
+             raise FetchError(f"Unexpected content type: {response.headers.get('content-type')}")
 
-    except httpx.HTTPError as e:
-        logger.error(f"HTTP error occurred while fetching shops: {e}")
-        return []
-    except Exception as e:
-        logger.error(f"An unexpected error occurred: {e}")
-        return []
+        if limit is not None and lxml_html is not None and SHOP_PARSER_BACKEND == "fast":
+            # A preview only needs the first `limit` shops: parse while reading and stop early
+            shops, page_count, body_hash = await _read_shop_page(response, limit)
+            if body_hash is None:
+                # Stopped early: the shops are a prefix of the page and must not be cached as the whole
+                return shops, page_count
+        else:
+            shops = None
+            body = bytearray()
+            async for chunk in http_client.iter_body(response):
+                body.extend(chunk)
+            body_hash = hashlib.sha1(body).hexdigest()
+            encoding = response.encoding or "utf-8"
+    finally:
+        await response.aclose()
 
-def parse_shops(html_content: str):
+    # Servers without validators still let us hand back the same list when the body is byte-identical
+    if cached and cached["body_hash"] == body_hash:
+        logger.info(f"Unchanged response body: {cache_key}")
+        shops, page_count = cached["shops"], cached["page_count"]
+    elif shops is None:
+        shops, page_count = _parse_page(body, encoding)
+    _store_response(cache_key, response, body_hash, shops, page_count)
+    return shops, page_count
+
+def _parse_page(body: bytes, encoding: str):
+    """
+    Parses a fully read page. Returns (shops, page count shown in its pager).
+    """
+    html = body.decode(encoding, errors="replace")
+    started_at = time.perf_counter()
+    shops = parse_shops(html)
+    metrics.PARSE_LATENCY.observe(time.perf_counter() - started_at)
+    return shops, _page_count(_PAGE_NUMBER_RE.findall(html))
+
+async def _read_shop_page(response: httpx.Response, limit: int):
+    """
+    Reads a streamed page through the incremental lxml parser until `limit` shops
+    are complete. Returns (shops, page count, body hash), with the hash None when
+    reading stopped early.
+    """
+    body_hash = hashlib.sha1()
+    parser = _StreamingShopParser(response.charset_encoding)
+    stopped_early = False
+    async for chunk in http_client.iter_body(response):
+        body_hash.update(chunk)
+        parser.feed(chunk)
+        if parser.completed >= limit:
+            stopped_early = True
+            break
+    shops, page_count = parser.close()
+    metrics.PARSE_LATENCY.observe(parser.parse_seconds)
+    if stopped_early:
+        return shops[:limit], page_count, None
+    return shops, page_count, body_hash.hexdigest()
+
+def _page_count(page_numbers) -> int:
+    return max((int(number) for number in page_numbers), default=1)
+
+def _store_response(cache_key: str, response: httpx.Response, body_hash: str, shops: list, page_count: int = 1):
+    _response_cache[cache_key] = {
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+        "body_hash": body_hash,
+        "shops": shops,
+        "page_count": page_count,
+    }
+    _response_cache.move_to_end(cache_key)
+    while len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+
+def parse_shops_html_parser(html_content: str):
     """
     Parses the HTML content to extract shop information.
+    Builds a full html.parser tree of the whole document.
     """
     soup = BeautifulSoup(html_content, "html.parser")
-    shops = []
 
     # Note: The selector below is based on observation of similar sites.
     # It might need adjustment if the actual HTML structure differs.
@@ -101,6 +263,11 @@ def parse_shops(html_content: str):
     if not main_content:
         return []
 
+    return _extract_shops(main_content)
+
+def _extract_shops(main_content):
+    shops = []
+
     # This is a best-guess selector. 
     # In a real scenario, I would inspect the HTML. 
     # Since I can't, I will try to capture typical structures.
@@ -129,3 +296,153 @@ def parse_shops(html_content: str):
             })
             
     return shops
+
+
+MAIN_CONTENT_ID_STRAINER = SoupStrainer("div", id="main_content")
+# Matched as a regex so a multi-class attribute ("main_content wide") is found like find(class_=...) does
+MAIN_CONTENT_CLASS_STRAINER = SoupStrainer("div", class_=re.compile(r"(^|\s)main_content(\s|$)"))
+# Superset of the containers _extract_shops looks for; it re-applies the exact selectors
+SHOP_CONTAINER_STRAINER = SoupStrainer(["div", "dl", "ul"], class_=re.compile(r"(^|\s)(shop-list-item|shop_detail|shop_list)(\s|$)"))
+
+def _has_class(tag: str, class_name: str) -> str:
+    return f".//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+def _lxml_text(element) -> str:
+    # Mirrors BeautifulSoup's get_text(strip=True): stripped text nodes joined, comments and scripts skipped
+    parts = []
+    for node in element.iter():
+        if isinstance(node.tag, str) and node.tag not in ("script", "style", "template") and node.text:
+            parts.append(node.text)
+        if node is not element and node.tail:
+            parts.append(node.tail)
+    return "".join(part.strip() for part in parts if part.strip())
+
+def _parse_shops_lxml(html_content: str, body_fallback: bool = True):
+    try:
+        root = lxml_html.document_fromstring(html_content)
+    except lxml_etree.ParserError:
+        # Empty or whitespace-only document
+        return []
+    return _extract_shops_lxml(root, body_fallback)
+
+def _extract_shops_lxml(root, body_fallback: bool = True):
+    main_content = _first(
+        root.find(".//div[@id='main_content']"),
+        next(iter(root.xpath(_has_class("div", "main_content"))), None),
+        root.find("body") if body_fallback else None,
+    )
+    if main_content is None:
+        return []
+
+    shop_items = main_content.xpath(_has_class("div", "shop-list-item"))
+    if not shop_items:
+        shop_items = main_content.xpath(_has_class("dl", "shop_detail"))
+    if not shop_items:
+        ul = next(iter(main_content.xpath(_has_class("ul", "shop_list"))), None)
+        if ul is not None:
+            shop_items = ul.findall(".//li")
+
+    shops = []
+    for item in shop_items:
+        name_el = _first(item.find(".//h3"), item.find(".//dt"), item.find(".//strong"))
+        address_el = _first(next(iter(item.xpath(_has_class("p", "address"))), None), item.find(".//dd"))
+        if name_el is not None:
+            shops.append({
+                "name": _lxml_text(name_el),
+                "address": _lxml_text(address_el) if address_el is not None else "住所不明"
+            })
+    return shops
+
+def _first(*elements):
+    # lxml elements are falsy when they have no children, so `or` cannot be used
+    for element in elements:
+        if element is not None:
+            return element
+    return None
+
+# Classes of the shop entry containers _extract_shops_lxml selects
+_SHOP_ITEM_CLASSES = {"div": "shop-list-item", "dl": "shop_detail"}
+
+def _is_shop_item(element) -> bool:
+    # Counts an entry once it is complete; the selectors are re-applied exactly on close()
+    if element.tag == "li":
+        parent = element.getparent()
+        if parent is None or parent.tag != "ul" or "shop_list" not in (parent.get("class") or "").split():
+            return False
+    elif _SHOP_ITEM_CLASSES.get(element.tag) not in (element.get("class") or "").split():
+        return False
+    return _first(element.find(".//h3"), element.find(".//dt"), element.find(".//strong")) is not None
+
+class _StreamingShopParser:
+    """
+    Builds a page's lxml tree chunk by chunk as the body arrives and counts the
+    complete shop entries so far, so the reader can stop once it has enough.
+    Shops are extracted on close() with the same selectors as parse_shops_fast.
+    """
+
+    def __init__(self, encoding: str = None):
+        self.parser = lxml_etree.HTMLPullParser(events=("end",), tag=("div", "dl", "li"), encoding=encoding)
+        self.completed = 0
+        self.parse_seconds = 0.0
+
+    def feed(self, chunk: bytes):
+        started_at = time.perf_counter()
+        self.parser.feed(chunk)
+        for _, element in self.parser.read_events():
+            if _is_shop_item(element):
+                self.completed += 1
+        self.parse_seconds += time.perf_counter() - started_at
+
+    def close(self):
+        """
+        Returns (shops, page count shown in the pager) for everything fed so far.
+        """
+        started_at = time.perf_counter()
+        try:
+            root = self.parser.close()
+        except lxml_etree.XMLSyntaxError:
+            # Nothing was fed: an empty page lists no shops, as parse_shops("") does
+            self.parse_seconds += time.perf_counter() - started_at
+            return [], 1
+        shops = _extract_shops_lxml(root) if root is not None else []
+        hrefs = root.xpath(f"//a[contains(@href, '{GPLUS_PAGE_PARAM}=')]/@href") if root is not None else []
+        page_count = _page_count(number for href in hrefs for number in _PAGE_NUMBER_RE.findall(href))
+        self.parse_seconds += time.perf_counter() - started_at
+        return shops, page_count
+
+def _parse_shops_strained(html_content: str, body_fallback: bool = True):
+    if "main_content" in html_content:
+        for strainer in (MAIN_CONTENT_ID_STRAINER, MAIN_CONTENT_CLASS_STRAINER):
+            soup = BeautifulSoup(html_content, "html.parser", parse_only=strainer)
+            main_content = soup.find("div")
+            if main_content:
+                return _extract_shops(main_content)
+
+    if not body_fallback:
+        return []
+    # No main_content container: the shop items can be anywhere in <body>
+    soup = BeautifulSoup(html_content, "html.parser", parse_only=SHOP_CONTAINER_STRAINER)
+    return _extract_shops(soup)
+
+def parse_shops_fast(html_content: str):
+    """
+    Same output as parse_shops_html_parser. Uses lxml directly when it is installed,
+    otherwise only builds the BeautifulSoup tree for the shop container.
+    """
+    # html.parser only falls back to <body> when the markup has one; lxml always adds
+    # one, so a bare fragment is searched through its main_content container alone
+    body_fallback = "<body" in html_content.lower()
+    if lxml_html is not None:
+        return _parse_shops_lxml(html_content, body_fallback)
+    return _parse_shops_strained(html_content, body_fallback)
+
+PARSER_BACKENDS = {
+    "html.parser": parse_shops_html_parser,
+    "fast": parse_shops_fast,
+}
+
+def parse_shops(html_content: str):
+    """
+    Parses the HTML content to extract shop information using the configured backend.
+    """
+    return PARSER_BACKENDS[SHOP_PARSER_BACKEND](html_content)
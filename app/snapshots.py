@@ -0,0 +1,83 @@
+import os
+import hashlib
+import json
+from datetime import timedelta
+
+# Adaptive polling: reset to the minimum after a change, back off exponentially otherwise
+POLL_MIN_INTERVAL = int(os.getenv("POLL_MIN_INTERVAL", "1800"))
+POLL_MAX_INTERVAL = int(os.getenv("POLL_MAX_INTERVAL", str(24 * 3600)))
+POLL_BACKOFF_FACTOR = float(os.getenv("POLL_BACKOFF_FACTOR", "2"))
+# Keys that restock regularly are polled at least this many times per typical restock gap
+POLL_RESTOCK_FRACTION = float(os.getenv("POLL_RESTOCK_FRACTION", "0.5"))
+
+
+def shop_key(shop: dict) -> str:
+    return f"{shop['name']}|{shop['address']}"
+
+
+def fingerprint(keys) -> str:
+    """
+    Compact hash of a sorted shop key list. Equal fingerprints mean the shop set is unchanged.
+    """
+    return hashlib.sha1("\n".join(keys).encode("utf-8")).hexdigest()
+
+
+def build_snapshot(shops: list):
+    """
+    Returns (fingerprint, sorted shop keys) for a parse_shops result.
+    """
+    keys = sorted({shop_key(shop) for shop in shops})
+    return fingerprint(keys), keys
+
+
+def diff_shops(previous_keys, shops: list):
+    """
+    Compares a new parse_shops result against the previously stored shop keys.
+    Returns (added shops, removed shop keys).
+    """
+    previous = set(previous_keys or [])
+    current = {shop_key(shop) for shop in shops}
+    added = [shop for shop in shops if shop_key(shop) not in previous]
+    removed = sorted(previous - current)
+    return added, removed
+
+
+def load_keys(snapshot) -> list:
+    if snapshot is None or not snapshot.shop_keys:
+        return []
+    return json.loads(snapshot.shop_keys)
+
+
+def record_poll(snapshot, changed: bool, now):
+    """
+    Updates a snapshot's polling state after a crawl and schedules its next crawl.
+    """
+    if changed or not snapshot.poll_interval:
+        snapshot.poll_interval = POLL_MIN_INTERVAL
+    else:
+        snapshot.poll_interval = int(min(POLL_MAX_INTERVAL, snapshot.poll_interval * POLL_BACKOFF_FACTOR))
+    if changed:
+        snapshot.last_changed_at = now
+    snapshot.last_crawled_at = now
+    snapshot.next_crawl_at = now + timedelta(seconds=snapshot.poll_interval)
+
+
+def record_poll_failure(snapshot, now):
+    """
+    Retries a failed key after the minimum interval without touching its backoff.
+    """
+    snapshot.next_crawl_at = now + timedelta(seconds=POLL_MIN_INTERVAL)
+
+
+def apply_restock_hint(snapshot, mean_gap: float):
+    """
+    Caps the backoff of a key at a fraction of its mean time between restocks
+    (see stock_history.restock_gaps), so a quiet spell never pushes the next crawl
+    past the next likely restock.
+    """
+    if not snapshot.poll_interval or snapshot.last_crawled_at is None:
+        return
+    cap = max(POLL_MIN_INTERVAL, int(mean_gap * POLL_RESTOCK_FRACTION))
+    if snapshot.poll_interval > cap:
+        snapshot.poll_interval = cap
+        snapshot.next_crawl_at = snapshot.last_crawled_at + timedelta(seconds=cap)
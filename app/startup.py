@@ -0,0 +1,105 @@
+"""
+Cold-start bookkeeping: time from process start to each startup stage, and how
+long each lazily loaded module took to import.
+
+Usage: python -m app.startup [MODULE] [--top N]
+Prints the per-module import times of MODULE (default app.main).
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import importlib
+import subprocess
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Load the scraper and crawl stack on first use instead of at startup
+LAZY_INIT = os.getenv("LAZY_INIT", "true").lower() == "true"
+
+
+def _process_age() -> float:
+    # Seconds since the process was started, so interpreter and framework imports count too
+    try:
+        with open("/proc/self/stat") as f:
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - started_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+STARTED_AT = time.perf_counter() - _process_age()
+_stages = {}
+_module_loads = {}
+
+
+def mark(stage: str):
+    """
+    Records the first time a stage is reached, e.g. "app_ready" or "first_response".
+    """
+    if stage in _stages:
+        return
+    elapsed = time.perf_counter() - STARTED_AT
+    _stages[stage] = elapsed
+    metrics.STARTUP_SECONDS.labels(stage).set(elapsed)
+    logger.info(f"Startup stage {stage} reached after {elapsed * 1000:.0f}ms")
+
+
+def load(name: str):
+    """
+    Imports a module on first use and records how long the import took.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started_at = time.perf_counter()
+    module = importlib.import_module(name)
+    elapsed = time.perf_counter() - started_at
+    _module_loads[name] = elapsed
+    metrics.MODULE_LOAD_SECONDS.labels(name).set(elapsed)
+    logger.info(f"Loaded {name} in {elapsed * 1000:.0f}ms")
+    return module
+
+
+def report() -> dict:
+    return {
+        "lazy_init": LAZY_INIT,
+        "stages": {stage: round(seconds, 4) for stage, seconds in _stages.items()},
+        "module_loads": {name: round(seconds, 4) for name, seconds in _module_loads.items()},
+    }
+
+
+def import_times(module: str = "app.main") -> list:
+    """
+    Imports `module` in a fresh interpreter with -X importtime and returns
+    (name, self seconds, cumulative seconds) for every module it pulled in.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("module", nargs="?", default="app.main")
+    parser.add_argument("--top", type=int, default=25, help="number of modules to list")
+    args = parser.parse_args()
+
+    rows = import_times(args.module)
+    total = next((cumulative for name, _, cumulative in rows if name == args.module), 0.0)
+    print(f"import {args.module}: {total * 1000:.0f}ms, {len(rows)} modules")
+    print(f"{'cumulative':>10}  {'self':>8}  module")
+    for name, self_seconds, cumulative in sorted(rows, key=lambda row: row[2], reverse=True)[:args.top]:
+        print(f"{cumulative * 1000:>8.1f}ms  {self_seconds * 1000:>6.1f}ms  {name}")
@@ -0,0 +1,155 @@
+"""
+Append-only stock history kept in the narrow stock_events table. Each row is a
+transition (a shop appeared in or disappeared from a product's shop list in one
+prefecture), so a shop's availability is the run of intervals between its
+in_stock=True and in_stock=False events. Every query below is served by one of
+the table's two composite indexes.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import async_crud, database, models, prefectures, snapshots
+
+# Window used for restock statistics and polling hints
+RESTOCK_WINDOW_DAYS = int(os.getenv("RESTOCK_WINDOW_DAYS", "30"))
+
+
+def _window_start(since: datetime = None) -> datetime:
+    return since or datetime.now(timezone.utc) - timedelta(days=RESTOCK_WINDOW_DAYS)
+
+
+def pref_code(prefecture: str):
+    code = prefectures.PREFECTURE_MAP.get(prefecture)
+    return int(code) if code else None
+
+
+def event_rows(changes: list, shop_ids: dict) -> list:
+    """
+    Turns crawl changes, (product_code, prefecture, added shops, removed keys, observed_at),
+    into stock_events rows. `shop_ids` maps shop keys to their interned shops.id.
+    """
+    rows = []
+    for product_code, prefecture, added, removed, observed_at in changes:
+        code = pref_code(prefecture)
+        if code is None:
+            continue
+        for shop in added:
+            rows.append({"observed_at": observed_at, "product_code": product_code, "pref_code": code, "shop_id": shop_ids[snapshots.shop_key(shop)], "in_stock": True})
+        for key in removed:
+            rows.append({"observed_at": observed_at, "product_code": product_code, "pref_code": code, "shop_id": shop_ids[key], "in_stock": False})
+    return rows
+
+
+async def last_in_stock(db: AsyncSession, product_code: str, prefecture: str):
+    """
+    Returns when the product was last seen in stock anywhere in the prefecture:
+    the last crawl if some shop still has it, otherwise when the last shop ran
+    out. None if it was never seen in stock.
+    """
+    snapshot = await async_crud.get_stock_snapshot(db, product_code, prefecture)
+    if snapshot is not None and snapshots.load_keys(snapshot):
+        return database.as_utc(snapshot.last_crawled_at or snapshot.updated_at)
+
+    last_out = await db.scalar(
+        select(func.max(models.StockEvent.observed_at)).filter(
+            models.StockEvent.product_code == product_code,
+            models.StockEvent.pref_code == pref_code(prefecture),
+            models.StockEvent.in_stock.is_(False),
+        )
+    )
+    return database.as_utc(last_out)
+
+
+async def restock_counts(db: AsyncSession, product_code: str, prefecture: str = None, since: datetime = None, limit: int = 20) -> list:
+    """
+    Shops that restocked the product most often since `since` (default: the last
+    RESTOCK_WINDOW_DAYS days), as (shop_id, name, address, restocks), most frequent first.
+    """
+    filters = [
+        models.StockEvent.product_code == product_code,
+        models.StockEvent.observed_at >= _window_start(since),
+        models.StockEvent.in_stock.is_(True),
+    ]
+    if prefecture is not None:
+        filters.append(models.StockEvent.pref_code == pref_code(prefecture))
+
+    restocks = func.count().label("restocks")
+    counts = (
+        select(models.StockEvent.shop_id, restocks)
+        .filter(*filters)
+        .group_by(models.StockEvent.shop_id)
+        .order_by(restocks.desc())
+        .limit(limit)
+        .subquery()
+    )
+    rows = await db.execute(
+        select(counts.c.shop_id, models.Shop.name, models.Shop.address, counts.c.restocks)
+        .join(models.Shop, models.Shop.id == counts.c.shop_id)
+        .order_by(counts.c.restocks.desc(), counts.c.shop_id)
+    )
+    return [tuple(row) for row in rows]
+
+
+async def shop_timeline(db: AsyncSession, shop_id: int, product_code: str = None, since: datetime = None) -> list:
+    """
+    Availability intervals of one shop, oldest first, as dicts with product_code,
+    prefecture, from and until (None while still in stock).
+    """
+    query = select(models.StockEvent).filter(models.StockEvent.shop_id == shop_id)
+    if product_code is not None:
+        query = query.filter(models.StockEvent.product_code == product_code)
+    if since is not None:
+        query = query.filter(models.StockEvent.observed_at >= since)
+    events = (await db.scalars(query.order_by(models.StockEvent.observed_at, models.StockEvent.id))).all()
+
+    intervals = []
+    open_intervals = {}
+    for event in events:
+        key = (event.product_code, event.pref_code)
+        if event.in_stock:
+            if key not in open_intervals:
+                open_intervals[key] = len(intervals)
+                intervals.append({
+                    "product_code": event.product_code,
+                    "prefecture": prefectures.PREFECTURE_NAMES.get(f"{event.pref_code:02d}"),
+                    "from": database.as_utc(event.observed_at),
+                    "until": None,
+                })
+        elif key in open_intervals:
+            intervals[open_intervals.pop(key)]["until"] = database.as_utc(event.observed_at)
+    return intervals
+
+
+async def restock_gaps(db: AsyncSession, keys: list, since: datetime = None) -> dict:
+    """
+    Mean seconds between restocks (crawls in which some shop came back) per
+    (product_code, prefecture) key, for keys with at least two restocks in the window.
+    """
+    codes = {(product_code, pref_code(prefecture)): (product_code, prefecture) for product_code, prefecture in keys}
+    codes = {code: key for code, key in codes.items() if code[1] is not None}
+    if not codes:
+        return {}
+
+    rows = await db.execute(
+        select(
+            models.StockEvent.product_code,
+            models.StockEvent.pref_code,
+            func.count(func.distinct(models.StockEvent.observed_at)),
+            func.min(models.StockEvent.observed_at),
+            func.max(models.StockEvent.observed_at),
+        )
+        .filter(
+            # The plain IN lets SQLite seek the key index; it scans on row-value IN alone
+            models.StockEvent.product_code.in_({product_code for product_code, _ in codes}),
+            tuple_(models.StockEvent.product_code, models.StockEvent.pref_code).in_(list(codes)),
+            models.StockEvent.observed_at >= _window_start(since),
+            models.StockEvent.in_stock.is_(True),
+        )
+        .group_by(models.StockEvent.product_code, models.StockEvent.pref_code)
+    )
+    gaps = {}
+    for product_code, code, restocks, first, last in rows:
+        if restocks >= 2:
+            gaps[codes[(product_code, code)]] = (database.as_utc(last) - database.as_utc(first)).total_seconds() / (restocks - 1)
+    return gaps
@@ -0,0 +1,74 @@
+import os
+from collections import namedtuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import async_crud
+from .ttl_cache import TTLCache
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# Bounds how stale an entry can get when several processes serve the same user
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "600"))
+
+CachedWatch = namedtuple("CachedWatch", ["id", "prefecture", "product_code", "product_url"])
+
+
+class CachedUser:
+    """
+    A user's id and, once loaded, their watches keyed by watch id.
+    """
+
+    def __init__(self, user_id):
+        self.id = user_id
+        self.watches = None
+
+    def find_watch(self, product_code: str, prefecture: str):
+        for watch in self.watches.values():
+            if watch.product_code == product_code and watch.prefecture == prefecture:
+                return watch
+        return None
+
+
+class UserCache(TTLCache):
+    """
+    Bounded TTL + LRU cache from line_user_id to the user's id and watch set, so
+    repeat webhook commands need at most one query. Entries are updated in place on
+    register and delete; events of one user are handled one at a time, so these
+    updates never race within a process.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        super().__init__(maxsize, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def get_user(self, db: AsyncSession, line_user_id: str) -> CachedUser:
+        """
+        Returns the cached user, creating the user row on first contact.
+        """
+        user = self.get(line_user_id)
+        if user is not None:
+            self.hits += 1
+            return user
+        self.misses += 1
+        user = CachedUser(await async_crud.upsert_user(db, line_user_id))
+        self.put(line_user_id, user)
+        return user
+
+    async def get_watches(self, db: AsyncSession, user: CachedUser) -> dict:
+        if user.watches is None:
+            watches = await async_crud.get_watches_by_user(db, user.id)
+            user.watches = {w.id: CachedWatch(w.id, w.prefecture, w.product_code, w.product_url) for w in watches}
+        return user.watches
+
+    def add_watch(self, user: CachedUser, watch):
+        if user.watches is not None:
+            user.watches[watch.id] = CachedWatch(watch.id, watch.prefecture, watch.product_code, watch.product_url)
+
+    def remove_watch(self, user: CachedUser, watch_id):
+        if user.watches is not None:
+            user.watches.pop(watch_id, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+users = UserCache()
@@ -0,0 +1,93 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "16"))
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", "10000"))
+WEBHOOK_DEDUP_TTL = float(os.getenv("WEBHOOK_DEDUP_TTL", "600"))
+
+
+class RecentIds:
+    """
+    Bounded TTL set of recently seen ids, used to drop webhook redeliveries.
+    """
+
+    def __init__(self, maxsize: int = WEBHOOK_DEDUP_SIZE, ttl: float = WEBHOOK_DEDUP_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def add(self, key) -> bool:
+        """
+        Records key and returns True if it was not seen within the TTL.
+        """
+        now = time.monotonic()
+        # Entries are in insertion order, so expired ones are at the front
+        while self.entries and next(iter(self.entries.values())) < now:
+            self.entries.popitem(last=False)
+        if key in self.entries:
+            return False
+        self.entries[key] = now + self.ttl
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return True
+
+
+class EventDispatcher:
+    """
+    Runs webhook events in the background. Events of the same user are handled one
+    at a time in arrival order; different users run concurrently up to a limit.
+    """
+
+    def __init__(self, handle, concurrency: int = WEBHOOK_CONCURRENCY):
+        self.handle = handle
+        self.semaphore = None
+        self.concurrency = concurrency
+        self.queues = {}
+        # The loop only keeps weak references to tasks; holding them here stops a running one being collected
+        self.tasks = set()
+        self.seen = RecentIds()
+
+    def submit(self, user_key, event_id, event) -> bool:
+        """
+        Queues event for user_key. Returns False if event_id was already seen.
+        """
+        if event_id and not self.seen.add(event_id):
+            logger.info(f"Dropping redelivered webhook event {event_id}")
+            metrics.WEBHOOK_DUPLICATES.inc()
+            return False
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        queue = self.queues.get(user_key)
+        if queue is None:
+            queue = asyncio.Queue()
+            self.queues[user_key] = queue
+            task = asyncio.create_task(self._run_user(user_key, queue))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        queue.put_nowait(event)
+        return True
+
+    async def _run_user(self, user_key, queue: asyncio.Queue):
+        try:
+            while not queue.empty():
+                event = queue.get_nowait()
+                async with self.semaphore:
+                    started_at = time.perf_counter()
+                    try:
+                        await self.handle(event)
+                    except Exception as e:
+                        logger.error(f"Error handling webhook event for {user_key}: {e}")
+                    metrics.WEBHOOK_EVENT_LATENCY.observe(time.perf_counter() - started_at)
+        finally:
+            # No await between the empty check and removal, so no event can slip in unseen
+            del self.queues[user_key]
+
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues.values())
@@ -0,0 +1,81 @@
+"""
+Measures command parsing throughput: the table-driven parser plus alias lookup
+against the old startswith chain and linear prefecture scan.
+
+Usage: python -m benchmarks.bench_commands [--repeat N]
+"""
+import argparse
+import re
+import time
+
+from app import commands, prefectures
+
+MESSAGES = [
+    "登録 東京 https://gashapon.jp/products/detail.php?jan_code=4570117912345",
+    "登録 京都 https://gashapon.jp/shop/gplus_list.php?product_code=4570117900001",
+    "登録 沖縄 https://gashapon.jp/products/detail.php?jan_code=4570117954321",
+    "一覧",
+    "確認",
+    "削除 0f8fad5b-d9cb-469f-a165-70867728950e",
+    "こんにちは",
+]
+
+
+def legacy_parse(text: str):
+    # The pre-table handler: startswith chain, linear substring scan, regex compiled per call
+    text = text.strip()
+    if text.startswith("登録"):
+        parts = text.split()
+        if len(parts) != 3:
+            return None
+        for name in prefectures.PREFECTURE_MAP:
+            if parts[1] in name:
+                break
+        else:
+            return None
+        match = re.search(r"(?:product_code|jan_code)=([a-zA-Z0-9]+)", parts[2])
+        return ("register", name, match.group(1) if match else None)
+    elif text == "一覧":
+        return ("list",)
+    elif text.startswith("削除"):
+        return ("delete", text.split())
+    elif text == "確認":
+        return ("check",)
+    return None
+
+
+def table_parse(text: str):
+    parsed = commands.parse(text)
+    if parsed is None or not parsed.args:
+        return parsed
+    if parsed.name == "register":
+        area, url = parsed.args
+        match = commands.PRODUCT_CODE_RE.search(url)
+        return ("register", prefectures.resolve(area), match.group(1) if match else None)
+    return parsed
+
+
+def measure(parse, repeat: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        for text in MESSAGES:
+            parse(text)
+    return repeat * len(MESSAGES) / (time.perf_counter() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    # The old scan resolved 京都 to 東京都; the alias index must not
+    assert legacy_parse(MESSAGES[1])[1] == "東京都"
+    assert table_parse(MESSAGES[1])[1] == ("京都府",)
+
+    print(f"{'parser':>8} {'commands/s':>12}")
+    for name, parse in (("legacy", legacy_parse), ("table", table_parse)):
+        print(f"{name:>8} {measure(parse, args.repeat):>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
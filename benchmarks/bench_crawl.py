@@ -0,0 +1,165 @@
+"""
+Offline end-to-end crawl load test.
+
+Runs run_crawl_task against a seeded SQLite database, a local stand-in for
+gashapon.jp's gplus_list.php (httpx.MockTransport) and a stand-in LINE API, then
+reports watches/s, per-watch latency percentiles and peak RSS.
+
+Usage: python -m benchmarks.bench_crawl --watches 10000 --keys 500 --latency 0.05 --error-rate 0.01
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import logging
+import resource
+import tempfile
+
+from benchmarks.fixtures import render_shop_page
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--watches", type=int, default=1000, help="number of watches to seed (100 to 100000)")
+    parser.add_argument("--users", type=int, default=0, help="number of users (default: watches / 5)")
+    parser.add_argument("--keys", type=int, default=200, help="distinct (product_code, prefecture) keys")
+    parser.add_argument("--max-shops", type=int, default=50, help="upper bound of shops per generated page")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated upstream latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream requests answered with 500")
+    parser.add_argument("--line-latency", type=float, default=0.02, help="simulated LINE API latency in seconds")
+    parser.add_argument("--database-url", default=None, help="defaults to a temporary SQLite file")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+args = parse_args()
+if args.database_url:
+    os.environ["DATABASE_URL"] = args.database_url
+else:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench_crawl.db"
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "bench")
+os.environ.setdefault("CRAWL_LOCK_PATH", os.path.join(tempfile.gettempdir(), "bench_crawl.lock"))
+
+import httpx  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from app import crawl_task, database, http_client, line_client, models, result_cache, schema, scraper  # noqa: E402
+
+
+class FakeLineBotApi:
+    """
+    Blocking stand-in for LineBotApi that only sleeps and counts calls.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.recipients = 0
+
+    def push_message(self, to, messages):
+        time.sleep(self.latency)
+        self.calls += 1
+        self.recipients += 1
+
+    def multicast(self, to, messages):
+        time.sleep(self.latency)
+        self.calls += 1
+        self.recipients += len(to)
+
+
+def make_transport(rng: random.Random):
+    requests = {"count": 0, "errors": 0}
+
+    async def handler(request: httpx.Request):
+        requests["count"] += 1
+        await asyncio.sleep(args.latency)
+        if rng.random() < args.error_rate:
+            requests["errors"] += 1
+            return httpx.Response(500, text="error")
+        product_code = request.url.params["product_code"]
+        count = random.Random(product_code).randint(0, args.max_shops)
+        return httpx.Response(200, text=render_shop_page(count, seed=int(product_code)), headers={"content-type": "text/html; charset=UTF-8"})
+
+    return httpx.MockTransport(handler), requests
+
+
+def seed_database(rng: random.Random):
+    prefectures = list(scraper.PREFECTURE_MAP)
+    keys = [(f"{4549660000000 + i}", rng.choice(prefectures)) for i in range(args.keys)]
+    user_count = args.users or max(1, args.watches // 5)
+
+    users = [{"id": models.uuid.uuid4(), "line_user_id": f"U{i:08d}"} for i in range(user_count)]
+    watches = []
+    for i in range(args.watches):
+        product_code, prefecture = keys[i % len(keys)]
+        watches.append({
+            "id": models.uuid.uuid4(),
+            "user_id": users[rng.randrange(user_count)]["id"],
+            "prefecture": prefecture,
+            "product_code": product_code,
+            "product_url": f"https://gashapon.jp/products/detail.php?jan_code={product_code}",
+        })
+
+    with database.engine.begin() as conn:
+        for i in range(0, len(users), 5000):
+            conn.execute(insert(models.User), users[i:i + 5000])
+        for i in range(0, len(watches), 5000):
+            conn.execute(insert(models.Watch), watches[i:i + 5000])
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run():
+    rng = random.Random(args.seed)
+    schema.run_migrations()
+    seed_database(rng)
+
+    transport, upstream = make_transport(rng)
+    http_client._client = httpx.AsyncClient(transport=transport)
+    # The stand-in does not need politeness limits
+    http_client.HOST_RATE_PER_SEC = 1e9
+    http_client.HOST_BURST = 10 ** 6
+    line = FakeLineBotApi(args.line_latency)
+    line_client.line_bot_api = line
+    result_cache.shop_cache.entries.clear()
+
+    # Per-watch latency: time from crawl start until its key has been fetched and diffed
+    latencies = []
+    crawl_started_at = None
+    original_crawl_key = crawl_task.crawl_key
+
+    async def timed_crawl_key(product_code, prefecture, key_watches, *rest, **kwargs):
+        result = await original_crawl_key(product_code, prefecture, key_watches, *rest, **kwargs)
+        latencies.extend([time.perf_counter() - crawl_started_at] * len(key_watches))
+        return result
+
+    crawl_task.crawl_key = timed_crawl_key
+    try:
+        crawl_started_at = time.perf_counter()
+        await crawl_task.run_crawl_task()
+        elapsed = time.perf_counter() - crawl_started_at
+    finally:
+        crawl_task.crawl_key = original_crawl_key
+        await http_client.close_client()
+        await database.async_engine.dispose()
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"watches:            {args.watches} ({args.keys} keys)")
+    print(f"elapsed:            {elapsed:.2f}s")
+    print(f"watches/s:          {args.watches / elapsed:.1f}")
+    print(f"upstream requests:  {upstream['count']} ({upstream['errors']} errors)")
+    print(f"LINE calls:         {line.calls} ({line.recipients} recipients)")
+    print(f"per-watch latency:  p50={percentile(latencies, 50):.3f}s p95={percentile(latencies, 95):.3f}s p99={percentile(latencies, 99):.3f}s")
+    print(f"peak RSS:           {peak_rss_mb:.1f} MB")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    asyncio.run(run())
@@ -0,0 +1,107 @@
+"""
+Stock history query latency over months of synthetic events.
+
+Seeds stock_events in a SQLite database (a crawl every --interval minutes for
+--days days over --keys keys, with shops flipping in and out of stock), then
+times the stock_history query helpers.
+
+Usage: python -m benchmarks.bench_history --days 180 --keys 500 --repeat 50
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=180, help="days of history to seed")
+    parser.add_argument("--keys", type=int, default=500, help="distinct (product_code, prefecture) keys")
+    parser.add_argument("--shops", type=int, default=20, help="shops per key")
+    parser.add_argument("--interval", type=int, default=60, help="minutes between crawls of a key")
+    parser.add_argument("--flip-rate", type=float, default=0.01, help="chance a shop changes state per crawl")
+    parser.add_argument("--repeat", type=int, default=50, help="timed calls per query")
+    parser.add_argument("--database-url", default=None, help="defaults to a temporary SQLite file")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench_history.db"
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from app import database, models, schema, scraper, stock_history  # noqa: E402
+
+
+def seed_database(rng: random.Random):
+    prefectures = list(scraper.PREFECTURE_MAP)
+    keys = [(f"{4549660000000 + i}", rng.choice(prefectures)) for i in range(args.keys)]
+    shops = [
+        {"id": i + 1, "shop_key": f"店舗{i}|住所{i}", "name": f"店舗{i}", "address": f"住所{i}"}
+        for i in range(args.keys * args.shops)
+    ]
+    start = datetime.now(timezone.utc) - timedelta(days=args.days)
+    crawls = args.days * 24 * 60 // args.interval
+
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Shop), shops)
+        batch = []
+        for index, (product_code, prefecture) in enumerate(keys):
+            code = stock_history.pref_code(prefecture)
+            shop_ids = range(index * args.shops + 1, (index + 1) * args.shops + 1)
+            in_stock = {shop_id: False for shop_id in shop_ids}
+            for crawl in range(crawls):
+                observed_at = start + timedelta(minutes=crawl * args.interval)
+                for shop_id in shop_ids:
+                    if rng.random() < args.flip_rate:
+                        in_stock[shop_id] = not in_stock[shop_id]
+                        batch.append({"observed_at": observed_at, "product_code": product_code, "pref_code": code, "shop_id": shop_id, "in_stock": in_stock[shop_id]})
+            if len(batch) >= 50000:
+                conn.execute(insert(models.StockEvent), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(models.StockEvent), batch)
+    return keys
+
+
+async def measure(name: str, query):
+    timings = []
+    for _ in range(args.repeat):
+        started_at = time.perf_counter()
+        await query()
+        timings.append(time.perf_counter() - started_at)
+    timings.sort()
+    print(f"{name:<18} p50={timings[len(timings) // 2] * 1000:7.2f}ms  max={timings[-1] * 1000:7.2f}ms")
+
+
+async def run():
+    rng = random.Random(args.seed)
+    schema.run_migrations()
+    started_at = time.perf_counter()
+    keys = seed_database(rng)
+    with database.engine.connect() as conn:
+        events = conn.scalar(select(func.count()).select_from(models.StockEvent))
+    print(f"seeded {events:,} events over {args.days} days in {time.perf_counter() - started_at:.1f}s")
+
+    product_code, prefecture = keys[0]
+    batch = rng.sample(keys, min(100, len(keys)))
+    since = datetime.now(timezone.utc) - timedelta(days=args.days)
+    try:
+        async with database.AsyncSessionLocal() as db:
+            await measure("last_in_stock", lambda: stock_history.last_in_stock(db, product_code, prefecture))
+            await measure("restock_counts", lambda: stock_history.restock_counts(db, product_code, prefecture, since=since))
+            await measure("shop_timeline", lambda: stock_history.shop_timeline(db, 1))
+            await measure(f"restock_gaps x{len(batch)}", lambda: stock_history.restock_gaps(db, batch))
+    finally:
+        await database.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    asyncio.run(run())
@@ -0,0 +1,52 @@
+"""
+Compares the shop list parser backends over the saved HTML fixtures.
+
+Usage: python -m benchmarks.bench_parser [--repeat N]
+
+Peak memory comes from tracemalloc, so it only counts Python allocations;
+libxml2's own buffers in the lxml path are not included.
+"""
+import argparse
+import time
+import tracemalloc
+
+from app import scraper
+from benchmarks.fixtures import FIXTURE_SIZES, load_fixture
+
+
+def measure(parse, html: str, repeat: int):
+    # Warm up once so imports and strainer setup are not counted
+    parse(html)
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        parse(html)
+    elapsed_ms = (time.perf_counter() - started_at) * 1000 / repeat
+
+    tracemalloc.start()
+    parse(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed_ms, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"Fast backend tree builder: {'lxml' if scraper.lxml_html is not None else 'strained html.parser'}")
+    print(f"{'shops':>6} {'size KB':>8} {'backend':>12} {'ms/parse':>10} {'peak KB':>10}")
+    for count in FIXTURE_SIZES:
+        html = load_fixture(count)
+        expected = scraper.parse_shops_html_parser(html)
+        actual = scraper.parse_shops_fast(html)
+        if actual != expected or len(expected) != count:
+            raise SystemExit(f"Backend mismatch on {count}-shop fixture")
+
+        for name, parse in scraper.PARSER_BACKENDS.items():
+            elapsed_ms, peak_kb = measure(parse, html, args.repeat)
+            print(f"{count:>6} {len(html.encode('utf-8')) / 1024:>8.1f} {name:>12} {elapsed_ms:>10.2f} {peak_kb:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
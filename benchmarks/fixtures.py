@@ -0,0 +1,84 @@
+"""
+Generates gplus_list.php-like HTML pages for offline benchmarks.
+
+Run `python -m benchmarks.fixtures` to (re)write the saved fixtures.
+"""
+import os
+import random
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+FIXTURE_SIZES = (0, 10, 200, 1000)
+
+CHAINS = ["ガシャポンのデパート", "イオンモール", "ヨドバシカメラ", "ラウンドワン", "トイザらス", "ビックカメラ", "アニメイト"]
+CITIES = ["千代田区丸の内", "新宿区西新宿", "渋谷区道玄坂", "豊島区東池袋", "台東区上野", "港区台場", "江東区豊洲"]
+
+HEADER = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="UTF-8">
+<title>取扱店舗一覧 | ガシャポンオフィシャルサイト</title>
+<link rel="stylesheet" href="/common/css/style.css">
+<script>window.dataLayer = window.dataLayer || [];{padding}</script>
+</head>
+<body>
+<header id="header"><nav class="global_nav"><ul>{nav}</ul></nav></header>
+<div id="main_content">
+<h2 class="title">取扱店舗一覧</h2>
+"""
+
+FOOTER = """</div>
+<footer id="footer"><ul class="footer_nav">{nav}</ul><p class="copyright">&copy; BANDAI</p></footer>
+</body>
+</html>
+"""
+
+
+def render_shop(index: int, rng: random.Random) -> str:
+    chain = rng.choice(CHAINS)
+    city = rng.choice(CITIES)
+    return (
+        '<dl class="shop_detail">'
+        f"<dt>{chain} {city.split('区')[0]}店 No.{index}</dt>"
+        f"<dd>東京都{city}{rng.randint(1, 9)}-{rng.randint(1, 30)}-{rng.randint(1, 20)}</dd>"
+        f'<dd class="tel">03-{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}</dd>'
+        "</dl>\n"
+    )
+
+
+def render_shop_page(count: int, seed: int = 0) -> str:
+    """
+    Returns a full page listing `count` shops, surrounded by the header, scripts
+    and navigation that make up most of a real response.
+    """
+    rng = random.Random(seed)
+    nav = "".join(f'<li><a href="/category/{i}">カテゴリ{i}</a></li>' for i in range(40))
+    html = [HEADER.format(padding="var _x=0;" * 2000, nav=nav)]
+    if count:
+        html.append('<div class="shop_list">\n')
+        html.extend(render_shop(i, rng) for i in range(count))
+        html.append("</div>\n")
+    else:
+        html.append('<p class="no_result">該当する店舗はありません。</p>\n')
+    html.append(FOOTER.format(nav=nav))
+    return "".join(html)
+
+
+def fixture_path(count: int) -> str:
+    return os.path.join(FIXTURE_DIR, f"shops_{count}.html")
+
+
+def load_fixture(count: int) -> str:
+    with open(fixture_path(count), encoding="utf-8") as f:
+        return f.read()
+
+
+def main():
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    for count in FIXTURE_SIZES:
+        with open(fixture_path(count), "w", encoding="utf-8") as f:
+            f.write(render_shop_page(count, seed=count))
+        print(f"Wrote {fixture_path(count)}")
+
+
+if __name__ == "__main__":
+    main()
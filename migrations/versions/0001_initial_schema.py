@@ -0,0 +1,51 @@
+"""Initial schema: users, watches, notifications
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", UUID(as_uuid=True), primary_key=True),
+        sa.Column("line_user_id", sa.String(), nullable=False),
+        sa.Column("display_name", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_users_line_user_id", "users", ["line_user_id"], unique=True)
+
+    op.create_table(
+        "watches",
+        sa.Column("id", UUID(as_uuid=True), primary_key=True),
+        sa.Column("user_id", UUID(as_uuid=True), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("prefecture", sa.String(), nullable=False),
+        sa.Column("product_url", sa.String(), nullable=False),
+        sa.Column("product_code", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+    op.create_table(
+        "notifications",
+        sa.Column("id", UUID(as_uuid=True), primary_key=True),
+        sa.Column("watch_id", UUID(as_uuid=True), sa.ForeignKey("watches.id"), nullable=False),
+        sa.Column("notified_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("payload_json", sa.Text(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("notifications")
+    op.drop_table("watches")
+    op.drop_index("ix_users_line_user_id", table_name="users")
+    op.drop_table("users")
@@ -0,0 +1,35 @@
+"""Add stock_snapshots
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases bootstrapped with create_all may already have this table
+    if sa.inspect(op.get_bind()).has_table("stock_snapshots"):
+        return
+
+    op.create_table(
+        "stock_snapshots",
+        sa.Column("id", UUID(as_uuid=True), primary_key=True),
+        sa.Column("product_code", sa.String(), nullable=False),
+        sa.Column("prefecture", sa.String(), nullable=False),
+        sa.Column("fingerprint", sa.String(40), nullable=False),
+        sa.Column("shop_keys", sa.Text(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint("product_code", "prefecture", name="uq_stock_snapshots_product_prefecture"),
+    )
+
+
+def downgrade():
+    op.drop_table("stock_snapshots")
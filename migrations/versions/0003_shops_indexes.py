@@ -0,0 +1,43 @@
+"""Normalized shops, shop id references on notifications, and lookup indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "shops",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("shop_key", sa.String(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("address", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_shops_shop_key", "shops", ["shop_key"], unique=True)
+
+    op.add_column("notifications", sa.Column("shop_ids", sa.Text(), nullable=True))
+    op.add_column("notifications", sa.Column("removed_shop_ids", sa.Text(), nullable=True))
+
+    op.create_index("ix_notifications_watch_id_notified_at", "notifications", ["watch_id", "notified_at"])
+    op.create_index("ix_watches_user_id", "watches", ["user_id"])
+    op.create_index("ix_watches_product_code_prefecture", "watches", ["product_code", "prefecture"])
+
+
+def downgrade():
+    op.drop_index("ix_watches_product_code_prefecture", table_name="watches")
+    op.drop_index("ix_watches_user_id", table_name="watches")
+    op.drop_index("ix_notifications_watch_id_notified_at", table_name="notifications")
+    with op.batch_alter_table("notifications") as batch_op:
+        batch_op.drop_column("removed_shop_ids")
+        batch_op.drop_column("shop_ids")
+    op.drop_index("ix_shops_shop_key", table_name="shops")
+    op.drop_table("shops")
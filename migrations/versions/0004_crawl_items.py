@@ -0,0 +1,41 @@
+"""Add crawl_items work queue
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "crawl_items",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("run_id", sa.String(), nullable=False),
+        sa.Column("product_code", sa.String(), nullable=False),
+        sa.Column("prefecture", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("lease_owner", sa.String(), nullable=True),
+        sa.Column("lease_expires_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index(
+        "uq_crawl_items_active_key", "crawl_items", ["product_code", "prefecture"], unique=True,
+        postgresql_where=sa.text("status IN ('pending', 'leased')"),
+        sqlite_where=sa.text("status IN ('pending', 'leased')"),
+    )
+    op.create_index("ix_crawl_items_status_id", "crawl_items", ["status", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_crawl_items_status_id", table_name="crawl_items")
+    op.drop_index("uq_crawl_items_active_key", table_name="crawl_items")
+    op.drop_table("crawl_items")
@@ -0,0 +1,30 @@
+"""Adaptive polling state on stock_snapshots
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("stock_snapshots", sa.Column("poll_interval", sa.Integer(), nullable=True))
+    op.add_column("stock_snapshots", sa.Column("last_crawled_at", sa.DateTime(timezone=True), nullable=True))
+    op.add_column("stock_snapshots", sa.Column("last_changed_at", sa.DateTime(timezone=True), nullable=True))
+    op.add_column("stock_snapshots", sa.Column("next_crawl_at", sa.DateTime(timezone=True), nullable=True))
+    op.create_index("ix_stock_snapshots_next_crawl_at", "stock_snapshots", ["next_crawl_at"])
+
+
+def downgrade():
+    op.drop_index("ix_stock_snapshots_next_crawl_at", table_name="stock_snapshots")
+    with op.batch_alter_table("stock_snapshots") as batch_op:
+        batch_op.drop_column("next_crawl_at")
+        batch_op.drop_column("last_changed_at")
+        batch_op.drop_column("last_crawled_at")
+        batch_op.drop_column("poll_interval")
@@ -0,0 +1,34 @@
+"""Add crawl_runs summary table
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "crawl_runs",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("worker", sa.String(), nullable=False),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("requests", sa.Integer(), nullable=False),
+        sa.Column("shops_found", sa.Integer(), nullable=False),
+        sa.Column("changed_keys", sa.Integer(), nullable=False),
+        sa.Column("notifications_sent", sa.Integer(), nullable=False),
+        sa.Column("push_failures", sa.Integer(), nullable=False),
+        sa.Column("db_queries", sa.Integer(), nullable=False),
+        sa.Column("db_seconds", sa.Float(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("crawl_runs")
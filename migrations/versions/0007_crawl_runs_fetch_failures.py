@@ -0,0 +1,22 @@
+"""Track fetch failures on crawl_runs
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("crawl_runs", sa.Column("fetch_failures", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade():
+    with op.batch_alter_table("crawl_runs") as batch_op:
+        batch_op.drop_column("fetch_failures")
@@ -0,0 +1,33 @@
+"""Add stock_events history table
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "stock_events",
+        sa.Column("id", sa.BigInteger().with_variant(sa.Integer(), "sqlite"), primary_key=True, autoincrement=True),
+        sa.Column("observed_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("product_code", sa.String(), nullable=False),
+        sa.Column("pref_code", sa.SmallInteger(), nullable=False),
+        sa.Column("shop_id", sa.Integer(), sa.ForeignKey("shops.id"), nullable=False),
+        sa.Column("in_stock", sa.Boolean(), nullable=False),
+    )
+    op.create_index("ix_stock_events_key_observed_at", "stock_events", ["product_code", "pref_code", "observed_at"])
+    op.create_index("ix_stock_events_shop_id_observed_at", "stock_events", ["shop_id", "observed_at"])
+
+
+def downgrade():
+    op.drop_index("ix_stock_events_shop_id_observed_at", table_name="stock_events")
+    op.drop_index("ix_stock_events_key_observed_at", table_name="stock_events")
+    op.drop_table("stock_events")
@@ -0,0 +1,22 @@
+"""Count upstream requests per crawl item
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("crawl_items", sa.Column("requests", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade():
+    with op.batch_alter_table("crawl_items") as batch_op:
+        batch_op.drop_column("requests")